@@ -0,0 +1,153 @@
+#! /usr/bin/env python3
+#
+# Analyzes many core files of a native image in parallel gdb batch sessions and merges the results into one report.
+#
+# Usage: svmcores.py <executable> <core>... [--script FILE] [--jobs N] [--top N] [--out REPORT]
+#
+# Every core file gets its own `gdb -batch` process that loads svmhelpers.py (from the directory of this script)
+# and writes structured results: grouped thread stacks (svm-threads), the heap histogram (svm-histo) and, with
+# --script, the svm-batch evaluation of a common script of Java debug-expressions. Up to --jobs sessions run at once.
+#
+# pylint: disable=invalid-name
+
+import argparse
+import concurrent.futures
+import json
+import os
+import shutil
+import subprocess
+import sys
+import tempfile
+
+helpers = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'svmhelpers.py')
+
+
+def gdb_commands(workdir, args):
+    commands = [
+        'set pagination off',
+        'set confirm off',
+        'source ' + helpers,
+        'svm-threads --top %d --json %s' % (args.top, os.path.join(workdir, 'threads.json')),
+    ]
+    if not args.no_histo:
+        commands.append('svm-histo --top %d --json %s' % (args.top, os.path.join(workdir, 'histo.json')))
+    if args.script:
+        commands.append('svm-batch %s --out %s' % (os.path.abspath(args.script), os.path.join(workdir, 'batch.jsonl')))
+    return commands
+
+
+def read_json(filename, lines=False):
+    if not os.path.exists(filename):
+        return None
+    with open(filename) as f:
+        if lines:
+            return [json.loads(line) for line in f if line.strip()]
+        return json.load(f)
+
+
+def analyze(core, args):
+    '''Runs one gdb batch session for core and returns its results'''
+    workdir = tempfile.mkdtemp(prefix='svmcores-')
+    try:
+        command = [args.gdb, '-batch', '-nx']
+        for gdb_command in gdb_commands(workdir, args):
+            command += ['-ex', gdb_command]
+        command += [args.executable, core]
+        result = {'core': core}
+        try:
+            process = subprocess.run(command, stdout=subprocess.PIPE, stderr=subprocess.STDOUT,
+                                     universal_newlines=True, timeout=args.timeout or None)
+            if process.returncode != 0:
+                result['error'] = 'gdb exited with %d' % process.returncode
+        except subprocess.TimeoutExpired:
+            result['error'] = 'timeout after %ds' % args.timeout
+            process = None
+        result['stacks'] = read_json(os.path.join(workdir, 'threads.json'))
+        result['histogram'] = read_json(os.path.join(workdir, 'histo.json'))
+        result['batch'] = read_json(os.path.join(workdir, 'batch.jsonl'), lines=True)
+        if result['stacks'] is None and process is not None:
+            # Keep the end of the gdb output to see what went wrong
+            result['error'] = result.get('error', 'no results') + ': ' + process.stdout[-2000:]
+        return result
+    finally:
+        shutil.rmtree(workdir, ignore_errors=True)
+
+
+def merge(results, top):
+    '''Combines the per-core results: stacks by thread and core count, histogram entries summed over all cores'''
+    stacks = dict()
+    histogram = dict()
+    for result in results:
+        # Groups with distinct pcs can render to the same frames; each core counts once per stack
+        keys = set()
+        for group in result.get('stacks') or []:
+            key = tuple(group['frames'])
+            entry = stacks.setdefault(key, {'frames': group['frames'], 'threads': 0, 'cores': 0})
+            entry['threads'] += len(group['threads'])
+            if key not in keys:
+                keys.add(key)
+                entry['cores'] += 1
+        for item in result.get('histogram') or []:
+            entry = histogram.setdefault(item['type'], {'type': item['type'], 'instances': 0, 'bytes': 0, 'cores': 0})
+            entry['instances'] += item['instances']
+            entry['bytes'] += item['bytes']
+            entry['cores'] += 1
+    merged_stacks = sorted(stacks.values(), key=lambda entry: (entry['cores'], entry['threads']), reverse=True)
+    merged_histogram = sorted(histogram.values(), key=lambda entry: entry['bytes'], reverse=True)
+    return {'stacks': merged_stacks[:top] if top else merged_stacks,
+            'histogram': merged_histogram[:top] if top else merged_histogram}
+
+
+def print_summary(report, out):
+    cores = report['cores']
+    failed = [result for result in cores if 'error' in result]
+    out.write('%d core files analyzed, %d with errors\n' % (len(cores), len(failed)))
+    for result in failed:
+        out.write('  %s: %s\n' % (result['core'], result['error'].splitlines()[0] if result['error'] else ''))
+    out.write('\nMost common stacks:\n')
+    for entry in report['merged']['stacks']:
+        out.write('%d threads in %d cores:\n' % (entry['threads'], entry['cores']))
+        for (level, frame) in enumerate(entry['frames']):
+            out.write('  #%-3d %s\n' % (level, frame))
+    if report['merged']['histogram']:
+        out.write('\n{:>12} {:>14} {:>6}  {}\n'.format('instances', 'bytes', 'cores', 'type'))
+        for entry in report['merged']['histogram']:
+            out.write('{:>12} {:>14} {:>6}  {}\n'.format(entry['instances'], entry['bytes'], entry['cores'], entry['type']))
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Analyze core files of a native image in parallel gdb batch sessions')
+    parser.add_argument('executable')
+    parser.add_argument('cores', nargs='+')
+    parser.add_argument('--script', help='svm-batch script evaluated in every core')
+    parser.add_argument('--jobs', type=int, default=os.cpu_count() or 1, help='number of concurrent gdb sessions')
+    parser.add_argument('--top', type=int, default=20, help='stacks and histogram entries kept per core and in the report')
+    parser.add_argument('--no-histo', action='store_true', help='skip the heap histogram')
+    parser.add_argument('--timeout', type=int, default=0, help='seconds per core file (0 for no limit)')
+    parser.add_argument('--gdb', default='gdb')
+    parser.add_argument('--out', help='write the merged report as JSON to this file')
+    args = parser.parse_args()
+
+    # The work happens in the gdb processes; the pool threads only wait for them
+    results = dict()
+    with concurrent.futures.ThreadPoolExecutor(max_workers=max(1, args.jobs)) as pool:
+        futures = dict((pool.submit(analyze, core, args), core) for core in args.cores)
+        for future in concurrent.futures.as_completed(futures):
+            core = futures[future]
+            try:
+                results[core] = future.result()
+            except (OSError, ValueError) as e:
+                results[core] = {'core': core, 'error': str(e)}
+            sys.stderr.write('[%d/%d] %s%s\n' % (len(results), len(args.cores), core, ' (failed)' if 'error' in results[core] else ''))
+
+    ordered = [results[core] for core in args.cores]
+    report = {'executable': args.executable, 'cores': ordered, 'merged': merge(ordered, args.top)}
+    if args.out:
+        with open(args.out, 'w') as out:
+            json.dump(report, out, indent=1)
+    print_summary(report, sys.stdout)
+    return 1 if all('error' in result for result in ordered) else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
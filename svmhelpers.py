@@ -15,6 +15,7 @@ if sys.version_info[0] != 3:
     )
     raise AssertionError(message)
 
+from array import array
 from contextlib import contextmanager
 import gdb
 import gdb.types
@@ -24,6 +25,16 @@ from gdb.unwinder import Unwinder
 
 import os
 import re
+import argparse
+import bisect
+import collections
+import itertools
+import json
+import mmap
+import signal
+import struct
+import threading
+import time
 
 _tracefile = None
 
@@ -38,16 +49,29 @@ class SVMUtil:
     with_addr = False
 
     hub_fieldname = '__hub__'
-    selfref_parents = dict()
-    selfref_cycles = set()
+    # Both are keyed by object address and evicted oldest-first beyond selfref_limit entries
+    selfref_parents = collections.OrderedDict()
+    selfref_cycles = collections.OrderedDict()
     selfref_check = True
+    selfref_limit = 100000
 
     print_cstr_limit = 40
     print_array_limit = 10
     print_depth_limit = 1
     print_static_fields = False
     complete_svar = False
+    bt_compact = False
+    deopt_stub_addrs = frozenset()
+    frame_unwinder = None
     hlreps = dict()
+    rtt_types = dict()
+    hub_type = None
+    # Reference encoding per inferior as (heap base, shift, reserved hub bits), see get_ref_encoding
+    ref_encodings = dict()
+    heap_base_registers = {'i386:x86-64': 'r14', 'aarch64': 'x27'}
+    heap_base_frame_limit = 64
+    boxed_types = {'java.lang.Boolean', 'java.lang.Byte', 'java.lang.Character', 'java.lang.Short',
+                   'java.lang.Integer', 'java.lang.Long', 'java.lang.Float', 'java.lang.Double'}
 
     @classmethod
     def selfref_reset(cls, current_prompt=None):
@@ -56,6 +80,21 @@ class SVMUtil:
         cls.selfref_cycles.clear()
         return None
 
+    @classmethod
+    @contextmanager
+    def selfref_scope(cls):
+        # Cycle detection state only lives for one top-level print
+        cls.selfref_reset()
+        try:
+            yield
+        finally:
+            cls.selfref_reset()
+
+    @classmethod
+    def selfref_evict(cls, entries):
+        while len(entries) > cls.selfref_limit:
+            entries.popitem(last=False)
+
     @classmethod
     def is_selfref(cls, value):
         if not cls.selfref_check:
@@ -76,13 +115,16 @@ class SVMUtil:
             # Filter out primitives (by trying to access the hub)
             child[cls.hub_fieldname]  # NOT a pointless-statement
 
+            child = cls.decode_value(child)
             (addr_child, addr_parent) = (int(child), int(parent))
             if cls.selfref_reachable(child, parent):
                 # trace(' <add selfref %x>' % addr_child)
-                cls.selfref_cycles.add(addr_child)
+                cls.selfref_cycles[addr_child] = None
+                cls.selfref_evict(cls.selfref_cycles)
             else:
                 # trace(' <add %x --> %x>' % (addr_child, addr_parent))
                 cls.selfref_parents[addr_child] = addr_parent
+                cls.selfref_evict(cls.selfref_parents)
         finally:
             return child
 
@@ -110,6 +152,12 @@ class SVMUtil:
 
     @classmethod
     def get_javastr(cls, ptr_to_javastr, error_result='<Invalid String>'):
+        try:
+            ptr_to_javastr = cls.decode_value(ptr_to_javastr)
+            javastr = cls.read_javastr(int(ptr_to_javastr))
+            return error_result if javastr is None else javastr
+        except Exception as e:
+            trace('<get_javastr bulk read exception: %s>' % e)
         try:
             char_array = ptr_to_javastr['value']
             # trace(' <char_array: %x>' % int(char_array))
@@ -125,17 +173,33 @@ class SVMUtil:
             trace('<get_javastr exception: %s>' % e)
             return error_result
 
+    @classmethod
+    def get_java_hashcode(cls, text):
+        # java.lang.String.hashCode over the UTF-16 code units, as unsigned 32-bit value
+        utf16_data = text.encode('utf-16-le')
+        hashcode = 0
+        for (code_unit,) in struct.iter_unpack('<H', utf16_data):
+            hashcode = (31 * hashcode + code_unit) & 0xffffffff
+        return hashcode
+
+    @classmethod
+    def unbox(cls, value):
+        try:
+            value = cls.decode_value(value)
+            if int(value) != 0 and cls.get_rtt_name(value) in cls.boxed_types:
+                return cls.cast_to_rtt(value)['value']
+        except Exception as e:
+            trace('<unbox exception: %s>' % e)
+        return value
+
     @classmethod
     def get_hub(cls, obj):
         try:
-            hub = obj[cls.hub_fieldname]
-            hub_addr = int(hub)
-            hub_addr_type = hub.type
-            # Mask out last 3 bits of address
-            mask = ~0b111
-            hub_addr &= mask
+            hub = cls.decode_value(obj)[cls.hub_fieldname]
+            # Mask out the reserved bits and decode relative to the heap base if needed
+            hub_addr = cls.decode_hub(int(hub))
             # Cast back to original type
-            hub = gdb.Value(hub_addr).cast(hub_addr_type)
+            hub = gdb.Value(hub_addr).cast(cls.get_full_pointer_type(hub.type))
             return hub
         except Exception as e:
             trace('<get_hub exception: %s>' % e)
@@ -144,52 +208,258 @@ class SVMUtil:
     @classmethod
     def get_rtt_name(cls, obj):
         try:
-            hub = cls.get_hub(obj)
+            hub = cls.get_hub(cls.decode_value(obj))
             return cls.get_javastr(hub['name'], None)
         except Exception as e:
             trace('<get_rtt_name exception: %s>' % e)
             return None
 
+    @classmethod
+    def get_rtt_typename(cls, rttname):
+        array_dimension = rttname.count('[')
+        if array_dimension > 0:
+            rttname = rttname[array_dimension:]
+        if rttname[0] == 'L':
+            classname_end = rttname.find(';')
+            rttname = rttname[1:classname_end]
+        else:
+            rttname = {
+                'Z': 'boolean',
+                'B': 'byte',
+                'C': 'char',
+                'D': 'double',
+                'F': 'float',
+                'I': 'int',
+                'J': 'long',
+                'S': 'short',
+            }.get(rttname, rttname)
+        for _ in range(array_dimension):
+            rttname += '[]'
+        return rttname
+
+    @classmethod
+    def lookup_rtt_type(cls, typename):
+        ptr_type = cls.rtt_types.get(typename)
+        if ptr_type is None:
+            ptr_type = gdb.lookup_type(typename).pointer()
+            cls.rtt_types[typename] = ptr_type
+        return ptr_type
+
     @classmethod
     def cast_to_rtt(cls, obj):
         try:
+            obj = cls.decode_value(obj)
             rttname = cls.get_rtt_name(obj)
             if not rttname:
                 trace('<cast_to_rtt: invalid rttname')
                 return obj
 
-            array_dimension = rttname.count('[')
-            if array_dimension > 0:
-                rttname = rttname[array_dimension:]
-            if rttname[0] == 'L':
-                classname_end = rttname.find(';')
-                rttname = rttname[1:classname_end]
-            else:
-                rttname = {
-                    'Z': 'boolean',
-                    'B': 'byte',
-                    'C': 'char',
-                    'D': 'double',
-                    'F': 'float',
-                    'I': 'int',
-                    'J': 'long',
-                    'S': 'short',
-                }.get(rttname, rttname)
-            for _ in range(array_dimension):
-                rttname += '[]'
-
+            rttname = cls.get_rtt_typename(rttname)
             if str(rttname) == str(obj.type):
                 return obj
 
-            dyntype = gdb.lookup_type(rttname)
-            ptr_dyntype = dyntype.pointer()
-            return obj.cast(ptr_dyntype)
+            return obj.cast(cls.lookup_rtt_type(rttname))
         except Exception as e:
             trace('<cast_to_rtt exception: %s>' % e)
             return obj
 
+    @classmethod
+    def get_hub_type(cls):
+        if cls.hub_type is None:
+            cls.hub_type = cls.get_full_pointer_type(gdb.lookup_type('java.lang.Object')[cls.hub_fieldname].type)
+        return cls.hub_type
+
+    @classmethod
+    def get_full_pointer_type(cls, ptr_type):
+        # Compressed references are described as narrow pointers; decoded addresses need a full-width one
+        stripped = ptr_type.strip_typedefs()
+        if stripped.code == gdb.TYPE_CODE_PTR:
+            full_type = stripped.target().pointer()
+            if full_type.sizeof > stripped.sizeof:
+                return full_type
+        return ptr_type
+
+    @classmethod
+    def read_memory(cls, address, length):
+        view = SVMCoreFile.read(address, length)
+        if view is not None:
+            return view
+        return gdb.selected_inferior().read_memory(address, length)
+
+    @classmethod
+    def get_symbol_constant(cls, symbol, default=None):
+        # Absolute symbols of the image carry their value as address
+        try:
+            return int(gdb.parse_and_eval('(long)&%s' % symbol))
+        except gdb.error:
+            return default
+
+    @classmethod
+    def is_svm_frame(cls, frame):
+        # Code compiled by SVM has qualified Java names; C functions (libc, JNI code, gcc clones like foo.part.0) do not
+        name = frame.name()
+        if not name or frame.type() not in (gdb.NORMAL_FRAME, gdb.INLINE_FRAME):
+            return False
+        name = name.split('(')[0]
+        return '.' in name and not re.search(r'\.(part|isra|constprop|cold|lto_priv)(\.\d+)?$', name)
+
+    @classmethod
+    def get_heap_bases(cls):
+        '''Yields (heap base, trusted) candidates: __svm_heap_base first, then the heap base register of SVM-compiled code'''
+        for address in sorted(cls.get_symbol_addresses('__svm_heap_base')):
+            yield (address, True)
+        if not cls.get_symbol_constant('__svm_use_heap_base', 1):
+            return
+        try:
+            frame = gdb.selected_frame()
+            register = cls.heap_base_registers.get(frame.architecture().name())
+            # Outside of SVM-compiled code the register holds anything, so look for the nearest Java frame
+            for _ in range(cls.heap_base_frame_limit):
+                if register is None or frame is None:
+                    return
+                if cls.is_svm_frame(frame):
+                    heap_base = int(frame.read_register(register))
+                    if heap_base:
+                        yield (heap_base, False)
+                    return
+                frame = frame.older()
+        except gdb.error as e:
+            trace('<get_heap_bases exception: %s>' % e)
+
+    @classmethod
+    def check_ref_encoding(cls, encoding):
+        '''True if a known image heap object decodes to a valid hub chain with encoding, None if there is none to check'''
+        try:
+            value = gdb.parse_and_eval("'%s.firstReadOnlyReferenceObject'" % SVMHeap.image_heap_info)
+            raw = int(value)
+        except gdb.error as e:
+            trace('<check_ref_encoding exception: %s>' % e)
+            return None
+        if not raw:
+            return None
+        obj = raw if cls.get_full_pointer_type(value.type) is value.type else cls.decode_ref(raw, encoding)
+        try:
+            # Every hub is an instance of java.lang.Class, and the hub of java.lang.Class is itself
+            class_hub = cls.read_hub(cls.read_hub(obj, encoding), encoding)
+            return class_hub != 0 and cls.read_hub(class_hub, encoding) == class_hub
+        except gdb.MemoryError:
+            return False
+
+    @classmethod
+    def get_ref_encoding(cls):
+        '''Returns (heap base, shift, reserved hub bits) of the selected inferior, detected once per inferior'''
+        inferior = gdb.selected_inferior().num
+        try:
+            return cls.ref_encodings[inferior]
+        except KeyError:
+            pass
+        reserved_bits = cls.get_symbol_constant('__svm_reserved_bits_mask', 0b111)
+        try:
+            compressed = SVMLayout.for_typename('java.lang.Object').hub_size == 4
+        except gdb.error as e:
+            trace('<get_ref_encoding exception: %s>' % e)
+            return (0, 0, reserved_bits)
+        if not compressed:
+            cls.ref_encodings[inferior] = (0, 0, reserved_bits)
+            return cls.ref_encodings[inferior]
+        shift = cls.get_symbol_constant('__svm_compressed_shift', 0)
+        unverified = None
+        for (heap_base, trusted) in cls.get_heap_bases():
+            encoding = (heap_base, shift, reserved_bits)
+            valid = cls.check_ref_encoding(encoding)
+            if valid or (valid is None and trusted):
+                cls.ref_encodings[inferior] = encoding
+                return encoding
+            if valid is None and unverified is None:
+                unverified = encoding
+        # Not cached: try again once a Java frame is selected
+        trace('<get_ref_encoding: heap base unknown>')
+        return unverified or (0, shift, reserved_bits)
+
+    @classmethod
+    def reset_ref_encodings(cls, event=None):
+        cls.ref_encodings.clear()
+
+    @classmethod
+    def decode_ref(cls, raw, encoding=None):
+        if not raw:
+            return raw
+        (heap_base, shift, _) = encoding or cls.get_ref_encoding()
+        return heap_base + (raw << shift)
+
+    @classmethod
+    def encode_ref(cls, addr, encoding=None):
+        if not addr:
+            return addr
+        (heap_base, shift, _) = encoding or cls.get_ref_encoding()
+        return (addr - heap_base) >> shift
+
+    @classmethod
+    def decode_hub(cls, raw, encoding=None):
+        # Mask out the reserved bits of the hub reference (see get_hub)
+        encoding = encoding or cls.get_ref_encoding()
+        return cls.decode_ref(raw & ~encoding[2], encoding)
+
+    @classmethod
+    def decode_value(cls, value):
+        '''Widens a compressed reference value to a full pointer of the same type'''
+        if not isinstance(value, gdb.Value):
+            return value
+        value_type = value.type
+        full_type = cls.get_full_pointer_type(value_type)
+        if full_type is value_type:
+            return value
+        return gdb.Value(cls.decode_ref(int(value))).cast(full_type)
+
+    @classmethod
+    def read_hub(cls, obj_addr, encoding=None):
+        layout = SVMLayout.for_typename('java.lang.Object')
+        return cls.decode_hub(int.from_bytes(cls.read_memory(obj_addr + layout.hub_offset, layout.hub_size), 'little'), encoding)
+
+    @classmethod
+    def read_javastr(cls, str_addr):
+        return cls.read_javastr_prefix(str_addr)[0]
+
+    @classmethod
+    def read_javastr_prefix(cls, str_addr, max_bytes=None):
+        '''Returns (text, bytes read, truncated) reading at most max_bytes of the String contents'''
+        str_layout = SVMLayout.for_typename('java.lang.String')
+        fields = str_layout.decode_dict(cls.read_memory(str_addr, str_layout.header_size))
+        value_addr = fields['value']
+        if not value_addr:
+            return None, 0, False
+        # Use the declared array type; going through the hub would need a String for the hub name
+        array_layout = SVMLayout.for_typename(str_layout.ref_types['value'])
+        length = array_layout.array_length(cls.read_memory(value_addr, array_layout.header_size))
+        utf16 = array_layout.elem_size == 2 or fields.get('coder', 0) == 1
+        size = length * array_layout.elem_size
+        if max_bytes is not None and size > max_bytes:
+            # Keep whole UTF-16 code units
+            size = max_bytes & ~1 if utf16 else max_bytes
+        data = bytes(cls.read_memory(value_addr + array_layout.array_offset, size))
+        text = data.decode('utf-16-le', 'replace') if utf16 else data.decode('latin-1')
+        return text, size, size < length * array_layout.elem_size
+
+    @classmethod
+    def resolve_java_path(cls, expr):
+        with SVMCommandPrettyPrint.lookup_scope():
+            value = cls.pp_command.resolve(expr)
+        if value is None or isinstance(value, str):
+            raise gdb.GdbError('No Java debug-expression "%s" in current context.' % expr)
+        return getattr(value, 'obj', value)
+
+    @classmethod
+    def resolve_address(cls, expr):
+        try:
+            return int(expr, 0)
+        except ValueError:
+            return int(cls.resolve_java_path(expr))
+
     @classmethod
     def get_symbol_address(cls, symbol):
+        address = SVMSymbolIndex.get_address(symbol)
+        if address is not None:
+            return address
         try:
             output = gdb.execute('info address ' + symbol, False, True)
             address = int(output.split(' at address ')[1].split('.')[0], 16)
@@ -197,8 +467,37 @@ class SVMUtil:
         except:
             return None
 
+    @classmethod
+    def get_symbol_addresses(cls, symbol):
+        # A symbol can be defined once per loaded SVM image
+        addresses = set()
+        for objfile in gdb.objfiles():
+            try:
+                sym = objfile.lookup_global_symbol(symbol) or objfile.lookup_static_symbol(symbol)
+                if sym is not None:
+                    addresses.add(int(sym.value().address))
+            except Exception as e:
+                trace('<get_symbol_addresses exception: %s>' % e)
+        if not addresses:
+            address = cls.get_symbol_address(symbol)
+            if address:
+                addresses.add(address)
+        return frozenset(addresses)
+
+    @classmethod
+    def update_deopt_stubs(cls, event=None):
+        cls.deopt_stub_addrs = cls.get_symbol_addresses('com.oracle.svm.core.deopt.Deoptimizer.deoptStub')
+        if cls.deopt_stub_addrs and cls.frame_unwinder is None:
+            cls.frame_unwinder = SVMFrameUnwinder()
+            gdb.unwinder.register_unwinder(gdb.current_objfile(), cls.frame_unwinder)
+            gdb.events.stop.connect(cls.frame_unwinder.clear_cache)
+            gdb.events.cont.connect(cls.frame_unwinder.clear_cache)
+
     @classmethod
     def get_address_symbol(cls, address):
+        symbol = SVMSymbolIndex.lookup(address)
+        if symbol is not None:
+            return symbol.split('(')[0]
         try:
             output = gdb.execute('info symbol ' + hex(address), False, True)
             symbol = str(output.split('(')[0])
@@ -207,6 +506,847 @@ class SVMUtil:
             return None
 
 
+class SVMSymbolIndex:
+    '''Minimal symbols per objfile, parsed once per objfile and looked up by binary search over sorted start addresses'''
+    msymbol_pattern = re.compile(r'^\[\s*\d+\] (\S) 0x([0-9a-fA-F]+) (.*)$', re.MULTILINE)
+    objfile_pattern = re.compile(r"^\s*Object file: `?(.*?)'?(?:, file type \S+)?$")
+    section_pattern = re.compile(r'0x([0-9a-fA-F]+)->0x([0-9a-fA-F]+) at 0x[0-9a-fA-F]+: (\S+)')
+    # Absolute symbols are constants, not code or data locations
+    skipped_types = {'a', 'A'}
+
+    # objfile filename -> (starts, ends, names); a symbol ends at the next symbol or at the end of its section
+    objfile_symbols = dict()
+    # linkage and demangled name -> address
+    addresses = dict()
+    # Set when objfiles were loaded that are not indexed yet
+    pending = True
+
+    @classmethod
+    def reset(cls, event=None):
+        cls.objfile_symbols.clear()
+        cls.addresses.clear()
+        cls.pending = True
+
+    @classmethod
+    def objfile_added(cls, event=None):
+        cls.pending = True
+
+    @classmethod
+    def parse_msymbols(cls, output):
+        '''Returns (address, section, linkage name, demangled name or None) for each code and data symbol'''
+        symbols = []
+        for match in cls.msymbol_pattern.finditer(output):
+            if match.group(1) in cls.skipped_types:
+                continue
+            # The section, the demangled name and the source file follow the linkage name
+            (name, _, rest) = match.group(3).partition(' section ')
+            (section, _, rest) = rest.partition(' ')
+            extra = [part.strip() for part in rest.split('  ') if part.strip()]
+            # A single trailing part is the demangled name of a mangled symbol or else the source file
+            demangled = extra[0] if len(extra) > 1 or (extra and name.startswith('_Z')) else None
+            symbols.append((int(match.group(2), 16), section or None, name, demangled))
+        return symbols
+
+    @classmethod
+    def parse_sections(cls, output):
+        '''Returns objfile filename -> section name -> (start, end) with relocated addresses'''
+        sections = dict()
+        current = None
+        for line in output.splitlines():
+            header = cls.objfile_pattern.match(line)
+            if header:
+                current = sections.setdefault(header.group(1), dict())
+                continue
+            match = cls.section_pattern.search(line)
+            if match is None or current is None:
+                continue
+            (start, end, name) = (int(match.group(1), 16), int(match.group(2), 16), match.group(3))
+            previous = current.get(name)
+            current[name] = (start, end) if previous is None else (min(previous[0], start), max(previous[1], end))
+        return sections
+
+    @classmethod
+    def read_sections(cls):
+        for command in ('maint info sections -all-objects', 'maint info sections ALLOBJ'):
+            try:
+                return cls.parse_sections(gdb.execute(command, False, True))
+            except gdb.error as e:
+                trace('<SVMSymbolIndex exception: %s>' % e)
+        return dict()
+
+    @classmethod
+    def build(cls, symbols, sections):
+        '''Returns (starts, ends, names) sorted by start, without overlaps into other sections or past the objfile'''
+        symbols.sort(key=lambda symbol: symbol[0])
+        unique = []
+        for symbol in symbols:
+            if not unique or unique[-1][0] != symbol[0]:
+                unique.append(symbol)
+        (starts, ends, names) = (array('Q'), array('Q'), [])
+        for (index, (start, section, name, demangled)) in enumerate(unique):
+            (next_start, next_section) = unique[index + 1][:2] if index + 1 < len(unique) else (None, None)
+            bounds = sections.get(section)
+            if bounds is not None and bounds[0] <= start < bounds[1]:
+                end = bounds[1] if next_start is None else min(next_start, bounds[1])
+            elif next_start is not None and next_section == section:
+                end = next_start
+            else:
+                # Unknown extent: the symbol can only be found by its start address
+                end = start + 1
+            starts.append(start)
+            ends.append(end)
+            names.append(demangled or name)
+        return starts, ends, names
+
+    @classmethod
+    def update(cls):
+        '''Indexes objfiles loaded since the last call, returns True if any were added'''
+        if not cls.pending:
+            return False
+        cls.pending = False
+        filenames = [objfile.filename for objfile in gdb.objfiles()
+                     if objfile.filename and objfile.filename not in cls.objfile_symbols]
+        if not filenames:
+            return False
+        sections = cls.read_sections()
+        for filename in filenames:
+            try:
+                output = gdb.execute('maint print msymbols -objfile "%s"' % filename, False, True)
+            except gdb.error as e:
+                trace('<SVMSymbolIndex exception: %s>' % e)
+                output = ''
+            symbols = cls.parse_msymbols(output)
+            for (start, _, name, demangled) in symbols:
+                cls.addresses.setdefault(name, start)
+                if demangled:
+                    cls.addresses.setdefault(demangled, start)
+            cls.objfile_symbols[filename] = cls.build(symbols, sections.get(filename, dict()))
+        return True
+
+    @classmethod
+    def get_address(cls, symbol):
+        cls.update()
+        return cls.addresses.get(symbol)
+
+    @classmethod
+    def lookup(cls, address):
+        '''Returns the name of the symbol whose range contains address'''
+        return cls.lookup_all([address]).get(address)
+
+    @classmethod
+    def lookup_all(cls, addresses):
+        '''Returns a dict from each resolvable address to its symbol name'''
+        cls.update()
+        result = dict()
+        for address in set(addresses):
+            for (starts, ends, names) in cls.objfile_symbols.values():
+                index = bisect.bisect_right(starts, address) - 1
+                if index >= 0 and address < ends[index]:
+                    result[address] = names[index]
+                    break
+        return result
+
+
+class SVMCoreFile:
+    '''Memory-mapped core file of the current target, read through its PT_LOAD segments without going through gdb'''
+    core_file_pattern = re.compile(r"core dump file:\s*`([^']+)'")
+    PT_LOAD = 1
+
+    # None until detected, False if the target is not a core file
+    filename = None
+    core = None
+    view = None
+    # Sorted segment start addresses and the matching (end address, file offset)
+    starts = array('Q')
+    segments = []
+
+    @classmethod
+    def reset(cls, event=None):
+        view = cls.view
+        (cls.filename, cls.view, cls.starts, cls.segments) = (None, None, array('Q'), [])
+        if cls.core is not None:
+            try:
+                view.release()
+                cls.core.close()
+            except BufferError:
+                # Memoryviews handed out earlier still refer to the mapping; it is closed once they are gone
+                pass
+            cls.core = None
+
+    @classmethod
+    def get_filename(cls):
+        corefile = getattr(gdb.selected_inferior(), 'corefile', None)
+        if corefile is not None:
+            return corefile.filename
+        match = cls.core_file_pattern.search(gdb.execute('info target', False, True))
+        return match.group(1) if match else None
+
+    @classmethod
+    def load(cls):
+        cls.filename = False
+        try:
+            filename = cls.get_filename()
+        except gdb.error as e:
+            trace('<SVMCoreFile exception: %s>' % e)
+            return
+        if not filename:
+            return
+        try:
+            with open(filename, 'rb') as core_file:
+                core = mmap.mmap(core_file.fileno(), 0, access=mmap.ACCESS_READ)
+        except (OSError, ValueError) as e:
+            trace('<SVMCoreFile exception: %s>' % e)
+            return
+        # Only little-endian ELF64 cores are read directly
+        if core[:4] != b'\x7fELF' or core[4] != 2 or core[5] != 1:
+            core.close()
+            return
+        (phoff,) = struct.unpack_from('<Q', core, 32)
+        (phentsize, phnum) = struct.unpack_from('<HH', core, 54)
+        segments = []
+        for index in range(phnum):
+            (p_type, _, p_offset, p_vaddr, _, p_filesz, _, _) = struct.unpack_from('<IIQQQQQQ', core, phoff + index * phentsize)
+            # Segments not dumped into the core (p_filesz == 0) are read through gdb, e.g. from the executable
+            if p_type == cls.PT_LOAD and p_filesz:
+                segments.append((p_vaddr, p_vaddr + p_filesz, p_offset))
+        segments.sort()
+        (cls.filename, cls.core, cls.view) = (filename, core, memoryview(core))
+        cls.starts = array('Q', (start for (start, _, _) in segments))
+        cls.segments = [(end, offset) for (_, end, offset) in segments]
+        trace('<SVMCoreFile: %d segments of %s>' % (len(segments), filename))
+
+    @classmethod
+    def read(cls, address, length):
+        '''Returns a memoryview of [address, address + length) from the core file, or None'''
+        if cls.filename is None:
+            cls.load()
+        if not cls.filename:
+            return None
+        index = bisect.bisect_right(cls.starts, address) - 1
+        if index < 0:
+            return None
+        (end, offset) = cls.segments[index]
+        if address + length > end:
+            return None
+        offset += address - cls.starts[index]
+        return cls.view[offset:offset + length]
+
+
+class SVMListing:
+    '''Entries parsed from an `info functions`/`info variables` listing, collected one regex slice per gdb.post_event'''
+    # Disjoint by name length modulo 8: balanced whatever prefixes (com., java., jdk., ...) the names share.
+    # gdb compiles these as POSIX basic regexps (no REG_EXTENDED), so groups and intervals need backslashes.
+    slices = [r'^\(.\{8\}\)*%s$' % ('.' * remainder) for remainder in range(8)]
+    listings = []
+
+    def __init__(self, name, command, parse_line, wanted=lambda: True):
+        self.name = name
+        self.command = command
+        self.parse_line = parse_line
+        self.wanted = wanted
+        # Changes whenever collected entries are discarded
+        self.generation = 0
+        self.pending = list(range(len(SVMListing.slices)))
+        self.scheduled = False
+        self.entries = collections.defaultdict(list)
+        self.seen = set()
+        SVMListing.listings.append(self)
+
+    @classmethod
+    def restart_all(cls, event=None):
+        for listing in cls.listings:
+            if listing.wanted():
+                listing.restart()
+
+    @classmethod
+    def refresh_all(cls, event=None):
+        for listing in cls.listings:
+            if listing.wanted():
+                listing.refresh()
+
+    def restart(self):
+        self.generation += 1
+        self.entries = collections.defaultdict(list)
+        self.seen = set()
+        self.refresh()
+
+    def refresh(self):
+        # A new objfile can add entries to any slice, so all slices are listed again; the entries collected so far
+        # stay usable and duplicates are dropped. A burst of new objfiles results in a single pass.
+        self.generation = self.generation or 1
+        self.pending = list(range(len(SVMListing.slices)))
+        self.schedule()
+
+    def schedule(self):
+        if self.pending and not self.scheduled:
+            self.scheduled = True
+            gdb.post_event(self.step)
+
+    def step(self):
+        self.scheduled = False
+        if self.pending:
+            self.collect_slice()
+            self.schedule()
+
+    def collect_slice(self):
+        regex = SVMListing.slices[self.pending.pop(0)]
+        try:
+            output = gdb.execute('%s %s' % (self.command, regex), False, True)
+        except gdb.error as e:
+            trace('<SVMListing %s exception: %s>' % (self.name, e))
+            return
+        for line in output.split('\n'):
+            entry = self.parse_line(line)
+            if entry is not None and entry not in self.seen:
+                self.seen.add(entry)
+                self.entries[entry[0]].append(entry[1])
+
+    def is_complete(self):
+        return not self.pending
+
+    def collected(self, kind):
+        '''Returns the entries of the given kind collected so far'''
+        return self.entries[kind]
+
+    def iter_entries(self, kind):
+        '''Yields the entries collected so far, then collects the remaining slices right away'''
+        index = 0
+        while True:
+            entries = self.entries[kind]
+            while index < len(entries):
+                yield entries[index]
+                index += 1
+            if self.is_complete():
+                return
+            self.collect_slice()
+
+    @staticmethod
+    def parse_function(line):
+        if line.startswith('static '):
+            if line.startswith('static CPointer') or line.startswith('static CStruct'):
+                beginpos = line.find(' ', 14) + 1 # find end of CPointer/CStruct part
+            else:
+                beginpos = 7 # startpos for whitespace search
+            # strip C-style return value declaration
+            return ('function', line[line.find(' ', beginpos):].lstrip(' []*').rstrip(' ;'))
+        if line.startswith('File ') and 'at 0x' in line:
+            # Runtime compiled code registered by the image
+            return ('installed', line[len('File '):-1])
+        return None
+
+    @staticmethod
+    def parse_variable(line):
+        if not line.startswith('static '):
+            return None
+        return ('variable', line[line.rfind(' ') + 1:-1])
+
+SVMListing.functions = SVMListing('functions', 'info functions', SVMListing.parse_function)
+SVMListing.variables = SVMListing('variables', 'info variables', SVMListing.parse_variable, lambda: SVMUtil.complete_svar)
+
+
+class SVMLayout:
+    '''Offsets and struct formats of a Java type, computed once from its debug info'''
+    by_typename = dict()
+    by_hub = dict()
+
+    int_formats = {1: 'b', 2: 'h', 4: 'i', 8: 'q'}
+    float_formats = {4: 'f', 8: 'd'}
+    ref_formats = {4: 'I', 8: 'Q'}
+    # Only references of this format are compressed; full-width pointers are raw addresses
+    compressed_format = 'I'
+
+    def __init__(self, typename, ptr_type):
+        self.typename = typename
+        self.ptr_type = ptr_type
+        struct_type = ptr_type.target().strip_typedefs()
+        self.size = struct_type.sizeof
+        self.hub_offset = 0
+        self.hub_size = 8
+        self.length_offset = None
+        self.array_offset = None
+        self.elem_format = None
+        self.elem_size = 0
+        self.elem_is_ref = False
+        self.elem_compressed = False
+        self.fields = []
+        self.ref_types = dict()
+        self.collect_fields(struct_type, 0)
+        self.fields.sort(key=lambda field: field[1])
+        self.field_names = dict((offset, name) for (name, offset, _, _) in self.fields)
+        self.field_map = dict((name, (offset, fmt, is_ref)) for (name, offset, fmt, is_ref) in self.fields)
+        self.struct = self.make_struct()
+        self.header_size = max(self.struct.size, self.size if self.array_offset is None else self.array_offset)
+
+    @classmethod
+    def reset(cls, event=None):
+        cls.by_typename.clear()
+        cls.by_hub.clear()
+        SVMUtil.rtt_types.clear()
+        SVMUtil.hub_type = None
+
+    @classmethod
+    def for_typename(cls, typename):
+        layout = cls.by_typename.get(typename)
+        if layout is None:
+            layout = cls(typename, SVMUtil.lookup_rtt_type(typename))
+            cls.by_typename[typename] = layout
+        return layout
+
+    @classmethod
+    def for_hub(cls, hub_addr):
+        try:
+            return cls.by_hub[hub_addr]
+        except KeyError:
+            pass
+        layout = None
+        try:
+            hub = gdb.Value(hub_addr).cast(SVMUtil.get_hub_type())
+            rttname = SVMUtil.get_javastr(hub['name'], None)
+            if rttname:
+                layout = cls.for_typename(SVMUtil.get_rtt_typename(rttname))
+        except Exception as e:
+            trace('<SVMLayout.for_hub exception: %s>' % e)
+        cls.by_hub[hub_addr] = layout
+        return layout
+
+    @classmethod
+    def of_object(cls, obj_addr):
+        return cls.for_hub(SVMUtil.read_hub(obj_addr))
+
+    @classmethod
+    def format_of(cls, field_type):
+        field_type = field_type.strip_typedefs()
+        if field_type.code == gdb.TYPE_CODE_PTR:
+            return cls.ref_formats.get(field_type.sizeof), True
+        typename = str(field_type)
+        if typename == 'boolean':
+            return '?', False
+        if typename == 'char':
+            return 'H', False
+        if field_type.code == gdb.TYPE_CODE_FLT:
+            return cls.float_formats.get(field_type.sizeof), False
+        if field_type.code in (gdb.TYPE_CODE_INT, gdb.TYPE_CODE_CHAR, gdb.TYPE_CODE_BOOL):
+            return cls.int_formats.get(field_type.sizeof), False
+        return None, False
+
+    def collect_fields(self, struct_type, base_offset):
+        for f in struct_type.fields():
+            if not hasattr(f, 'bitpos'):  # static fields have no bitpos
+                continue
+            offset = base_offset + f.bitpos // 8
+            if f.is_base_class:
+                self.collect_fields(f.type.strip_typedefs(), offset)
+                continue
+            name = str(f.name)
+            if name == SVMUtil.hub_fieldname:
+                self.hub_offset = offset
+                self.hub_size = f.type.strip_typedefs().sizeof
+            elif name == '__length__':
+                self.length_offset = offset
+            elif name == '__array__':
+                elem_type = f.type.strip_typedefs().target()
+                self.array_offset = offset
+                self.elem_size = elem_type.strip_typedefs().sizeof
+                (self.elem_format, self.elem_is_ref) = SVMLayout.format_of(elem_type)
+                self.elem_compressed = self.elem_is_ref and self.elem_format == SVMLayout.compressed_format
+            else:
+                (fmt, is_ref) = SVMLayout.format_of(f.type)
+                if fmt:
+                    self.fields.append((name, offset, fmt, is_ref))
+                if is_ref:
+                    self.ref_types[name] = str(f.type.strip_typedefs().target())
+
+    def make_struct(self):
+        fmt = '<'
+        pos = 0
+        self.decoded = []
+        for (name, offset, field_fmt, is_ref) in self.fields:
+            if offset < pos:
+                continue
+            if offset > pos:
+                fmt += '%dx' % (offset - pos)
+            fmt += field_fmt
+            pos = offset + struct.calcsize('<' + field_fmt)
+            self.decoded.append((name, is_ref, is_ref and field_fmt == SVMLayout.compressed_format))
+        return struct.Struct(fmt)
+
+    def is_array(self):
+        return self.array_offset is not None
+
+    def decode(self, buf):
+        values = self.struct.unpack_from(buf, 0)
+        encoding = SVMUtil.get_ref_encoding()
+        for ((name, is_ref, compressed), value) in zip(self.decoded, values):
+            yield (name, SVMUtil.decode_ref(value, encoding) if compressed else value, is_ref)
+
+    def decode_dict(self, buf):
+        return dict((name, value) for (name, value, _) in self.decode(buf))
+
+    def read_field(self, obj_addr, name):
+        '''Returns (value, is_ref) of a single field with one small memory read'''
+        (offset, fmt, is_ref) = self.field_map[name]
+        value = struct.unpack_from('<' + fmt, SVMUtil.read_memory(obj_addr + offset, struct.calcsize('<' + fmt)))[0]
+        compressed = is_ref and fmt == SVMLayout.compressed_format
+        return (SVMUtil.decode_ref(value) if compressed else value), is_ref
+
+    def read_element(self, obj_addr, index):
+        length = self.array_length(SVMUtil.read_memory(obj_addr, self.header_size))
+        if index < 0 or index >= length:
+            raise IndexError('index %d out of bounds for length %d' % (index, length))
+        value = struct.unpack_from('<' + self.elem_format, SVMUtil.read_memory(obj_addr + self.array_offset + index * self.elem_size, self.elem_size))[0]
+        return (SVMUtil.decode_ref(value) if self.elem_compressed else value), self.elem_is_ref
+
+    def array_length(self, buf):
+        if self.length_offset is None:
+            return 0
+        return struct.unpack_from('<i', buf, self.length_offset)[0]
+
+    def object_size(self, length=0):
+        if self.is_array():
+            size = self.array_offset + length * self.elem_size
+        else:
+            size = self.size
+        return (size + 7) & ~7
+
+    def iter_elements(self, obj_addr, length, chunk_length=0x10000):
+        elem_struct = '<%d' + self.elem_format
+        for start in range(0, length, chunk_length):
+            count = min(chunk_length, length - start)
+            buf = SVMUtil.read_memory(obj_addr + self.array_offset + start * self.elem_size, count * self.elem_size)
+            values = struct.unpack_from(elem_struct % count, buf, 0)
+            if self.elem_compressed:
+                encoding = SVMUtil.get_ref_encoding()
+                values = [SVMUtil.decode_ref(value, encoding) for value in values]
+            yield values
+
+
+class SVMHeap:
+    '''Object ranges of the image heap and the runtime heap chunks, walked with block-sized memory reads'''
+    image_heap_info = 'com.oracle.svm.core.heap.NativeImageInfo'
+    image_heap_partitions = ['ReadOnlyPrimitive', 'ReadOnlyReference', 'WritablePrimitive', 'WritableReference']
+    heap_impl_typename = 'com.oracle.svm.core.genscavenge.HeapImpl'
+    space_search_depth = 3
+
+    # Chunk header layout, taken from the debug info if available (can be overridden in $SVMGDBINITFILE)
+    chunk_header_types = {
+        'aligned': 'com.oracle.svm.core.genscavenge.AlignedHeapChunk$AlignedHeader',
+        'unaligned': 'com.oracle.svm.core.genscavenge.UnalignedHeapChunk$UnalignedHeader',
+    }
+    chunk_top_offset = 0
+    chunk_next_offset = 24
+    chunk_header_size = {'aligned': 40, 'unaligned': 40}
+
+    block_size = 1 << 20
+    image_ranges = None
+    # The HeapImpl singleton lives in the image heap (0 if not found); chunk ranges change whenever the inferior runs
+    heap_impl = None
+    chunk_ranges = None
+
+    @classmethod
+    def reset(cls, event=None):
+        cls.image_ranges = None
+        cls.heap_impl = None
+        cls.chunk_ranges = None
+
+    @classmethod
+    def reset_chunks(cls, event=None):
+        cls.chunk_ranges = None
+
+    @classmethod
+    def static_ref(cls, name):
+        try:
+            return int(gdb.parse_and_eval("'%s.%s'" % (cls.image_heap_info, name)))
+        except Exception as e:
+            trace('<SVMHeap.static_ref exception: %s>' % e)
+            return 0
+
+    @classmethod
+    def get_image_ranges(cls):
+        if cls.image_ranges is None:
+            cls.image_ranges = []
+            for partition in cls.image_heap_partitions:
+                first = cls.static_ref('first%sObject' % partition)
+                last = cls.static_ref('last%sObject' % partition)
+                if not first or not last:
+                    continue
+                layout = SVMLayout.of_object(last)
+                if layout is None:
+                    continue
+                last_length = layout.array_length(SVMUtil.read_memory(last, layout.header_size))
+                cls.image_ranges.append((first, last + layout.object_size(last_length), 'image'))
+        return cls.image_ranges
+
+    @classmethod
+    def chunk_layout(cls, kind):
+        try:
+            header_type = gdb.lookup_type(cls.chunk_header_types[kind])
+            offsets = dict((str(f.name), f.bitpos // 8) for f in header_type.fields() if hasattr(f, 'bitpos'))
+            return offsets.get('top', cls.chunk_top_offset), offsets.get('next', cls.chunk_next_offset), (header_type.sizeof + 7) & ~7
+        except Exception as e:
+            trace('<SVMHeap.chunk_layout exception: %s>' % e)
+            return cls.chunk_top_offset, cls.chunk_next_offset, cls.chunk_header_size[kind]
+
+    @classmethod
+    def find_spaces(cls, heap_impl):
+        spaces = []
+        seen = set()
+        pending = [(heap_impl, 0)]
+        while pending:
+            (addr, depth) = pending.pop()
+            layout = SVMLayout.of_object(addr)
+            if layout is None or layout.is_array():
+                continue
+            decoded = list(layout.decode(SVMUtil.read_memory(addr, layout.header_size)))
+            fields = dict((name, value) for (name, value, _) in decoded)
+            if 'firstAlignedHeapChunk' in fields:
+                spaces.append(fields)
+                continue
+            if depth < cls.space_search_depth:
+                for (_, value, is_ref) in decoded:
+                    if is_ref and value and value not in seen:
+                        seen.add(value)
+                        pending.append((value, depth + 1))
+        return spaces
+
+    @classmethod
+    def in_image_heap(cls, addr):
+        return any(start <= addr < end for (start, end, _) in cls.get_image_ranges())
+
+    @classmethod
+    def find_heap_impl(cls, image_ranges):
+        if cls.heap_impl is None:
+            cls.heap_impl = 0
+            for (start, end, _) in image_ranges:
+                for (addr, layout, _) in cls.objects(start, end):
+                    if layout.typename == cls.heap_impl_typename:
+                        cls.heap_impl = addr
+                        break
+                if cls.heap_impl:
+                    break
+            if not cls.heap_impl:
+                trace('<SVMHeap: no %s instance in the image heap>' % cls.heap_impl_typename)
+        return cls.heap_impl
+
+    @classmethod
+    def get_chunk_ranges(cls, image_ranges):
+        if cls.chunk_ranges is not None:
+            return cls.chunk_ranges
+        heap_impl = cls.find_heap_impl(image_ranges)
+        if not heap_impl:
+            return []
+
+        ranges = []
+        visited = set()
+        for space in cls.find_spaces(heap_impl):
+            for kind in ['aligned', 'unaligned']:
+                (top_offset, next_offset, header_size) = cls.chunk_layout(kind)
+                chunk = space.get('first%sHeapChunk' % kind.capitalize(), 0)
+                # A corrupt chunk list (e.g. in a core) must not make the walk loop forever
+                while chunk and chunk not in visited:
+                    visited.add(chunk)
+                    top = int.from_bytes(SVMUtil.read_memory(chunk + top_offset, 8), 'little')
+                    ranges.append((chunk + header_size, top, kind))
+                    chunk = int.from_bytes(SVMUtil.read_memory(chunk + next_offset, 8), 'little')
+                if chunk:
+                    trace('<SVMHeap: cycle in %s chunk list at 0x%x>' % (kind, chunk))
+        cls.chunk_ranges = ranges
+        return ranges
+
+    @classmethod
+    def get_ranges(cls):
+        image_ranges = cls.get_image_ranges()
+        try:
+            return image_ranges + cls.get_chunk_ranges(image_ranges)
+        except gdb.MemoryError as e:
+            trace('<SVMHeap.get_ranges exception: %s>' % e)
+            return image_ranges
+
+    @classmethod
+    def objects(cls, start, end):
+        '''Yields (address, layout, size) for every object in [start, end)'''
+        object_layout = SVMLayout.for_typename('java.lang.Object')
+        (hub_offset, hub_size) = (object_layout.hub_offset, object_layout.hub_size)
+        encoding = SVMUtil.get_ref_encoding()
+        header_size = 32
+        block = b''
+        block_start = block_end = start
+        addr = start
+        while addr < end:
+            if addr + header_size > block_end:
+                block_start = addr
+                block_end = min(end, addr + cls.block_size)
+                block = SVMUtil.read_memory(block_start, block_end - block_start)
+                if addr + hub_offset + hub_size > block_end:
+                    break
+            pos = addr - block_start
+            raw_hub = int.from_bytes(block[pos + hub_offset:pos + hub_offset + hub_size], 'little')
+            if raw_hub == 0:
+                # Alignment filler
+                addr += 8
+                continue
+            layout = SVMLayout.for_hub(SVMUtil.decode_hub(raw_hub, encoding))
+            if layout is None:
+                trace('<SVMHeap.objects: unknown hub at 0x%x, skipping rest of range>' % addr)
+                break
+            length = 0
+            if layout.is_array():
+                if addr + layout.array_offset > block_end:
+                    block = SVMUtil.read_memory(addr, layout.array_offset)
+                    (block_start, block_end, pos) = (addr, addr + layout.array_offset, 0)
+                length = struct.unpack_from('<i', block, pos + layout.length_offset)[0]
+            size = layout.object_size(length)
+            if length < 0 or size <= 0:
+                # Corrupt array length: the walk would stall or move backwards
+                trace('<SVMHeap.objects: invalid length %d at 0x%x, skipping rest of range>' % (length, addr))
+                break
+            yield (addr, layout, size)
+            addr += size
+
+    @classmethod
+    def find_slots(cls, start, end, needles, slot_size):
+        '''Yields (slot address, needle) for every aligned slot in [start, end) holding one of the needles'''
+        for block_start in range(start, end, cls.block_size):
+            block = bytes(SVMUtil.read_memory(block_start, min(cls.block_size, end - block_start)))
+            for needle in needles:
+                # bytes.find scans the whole block in C; only hits need to be checked for alignment
+                pos = block.find(needle)
+                while pos >= 0:
+                    if pos % slot_size == 0:
+                        yield (block_start + pos, needle)
+                    pos = block.find(needle, pos + 1)
+
+    @classmethod
+    def slot_name(cls, layout, offset):
+        if layout.is_array() and offset >= layout.array_offset:
+            return '[%d]' % ((offset - layout.array_offset) // layout.elem_size)
+        return '.' + layout.field_names.get(offset, '<offset %d>' % offset)
+
+    @classmethod
+    def find_refs(cls, targets, max_hits=None, ranges=None):
+        '''Returns (slot address, target, object address, layout, slot name) for references to any of the targets'''
+        object_layout = SVMLayout.for_typename('java.lang.Object')
+        slot_size = object_layout.hub_size
+        encoding = SVMUtil.get_ref_encoding()
+        needles = dict((SVMUtil.encode_ref(target, encoding).to_bytes(slot_size, 'little'), target) for target in targets)
+        hits = []
+        for (start, end, _) in (ranges if ranges is not None else cls.get_ranges()):
+            slots = []
+            try:
+                for (slot, needle) in cls.find_slots(start, end, needles, slot_size):
+                    slots.append((slot, needles[needle]))
+                    if max_hits and len(hits) + len(slots) >= max_hits:
+                        break
+                if not slots:
+                    continue
+                # Map the hits to their containing objects with a single walk over the range
+                slots.sort()
+                index = 0
+                for (addr, layout, size) in cls.objects(start, end):
+                    while index < len(slots) and slots[index][0] < addr + size:
+                        (slot, target) = slots[index]
+                        if slot >= addr:
+                            hits.append((slot, target, addr, layout, cls.slot_name(layout, slot - addr)))
+                        index += 1
+                    if index == len(slots):
+                        break
+            except gdb.MemoryError as e:
+                trace('<SVMHeap.find_refs exception: %s>' % e)
+            if max_hits and len(hits) >= max_hits:
+                break
+        return hits
+
+
+class SVMPrintBudget:
+    '''Time and memory-read limits for pretty printing per stop and per printed value (0 means unlimited)'''
+    stop_ms = 0
+    stop_bytes = 0
+    value_ms = 0
+    value_bytes = 0
+
+    stop_start = time.time()
+    stop_used = 0
+    # Printed and truncated values since the last stop and since the limits were set
+    counts = collections.Counter()
+    totals = collections.Counter()
+
+    def __init__(self):
+        self.start = time.time()
+        self.used = 0
+
+    @classmethod
+    def active(cls):
+        return bool(cls.stop_ms or cls.stop_bytes or cls.value_ms or cls.value_bytes)
+
+    @classmethod
+    def reset(cls, event=None):
+        cls.stop_start = time.time()
+        cls.stop_used = 0
+        cls.counts.clear()
+
+    @classmethod
+    def for_value(cls):
+        '''Returns the budget of a new value or None if printing is not limited'''
+        if not cls.active():
+            return None
+        cls.count('printed')
+        return cls()
+
+    @classmethod
+    def count(cls, name):
+        cls.counts[name] += 1
+        cls.totals[name] += 1
+
+    @classmethod
+    def stop_exhausted(cls):
+        if cls.stop_ms and (time.time() - cls.stop_start) * 1000 > cls.stop_ms:
+            return True
+        return bool(cls.stop_bytes) and cls.stop_used >= cls.stop_bytes
+
+    @classmethod
+    def truncated(cls, text):
+        cls.count('truncated')
+        return text + ' [truncated]'
+
+    @classmethod
+    def report(cls):
+        return 'print budget: %d of %d values truncated since the last stop, %d of %d in total' % (
+            cls.counts['truncated'], cls.counts['printed'], cls.totals['truncated'], cls.totals['printed'])
+
+    def charge(self, nbytes):
+        self.used += nbytes
+        SVMPrintBudget.stop_used += nbytes
+
+    def exhausted(self):
+        if self.value_ms and (time.time() - self.start) * 1000 > self.value_ms:
+            return True
+        if self.value_bytes and self.used >= self.value_bytes:
+            return True
+        return SVMPrintBudget.stop_exhausted()
+
+    def remaining_bytes(self):
+        limits = []
+        if self.value_bytes:
+            limits.append(self.value_bytes - self.used)
+        if self.stop_bytes:
+            limits.append(self.stop_bytes - SVMPrintBudget.stop_used)
+        return max(0, min(limits)) if limits else None
+
+
+class SVMPPTruncated:
+    '''Printed instead of values once the per-stop print budget is used up'''
+    def __init__(self, obj):
+        self.obj = obj
+
+    def to_string(self):
+        value = str(self.obj.type.strip_typedefs().target())
+        try:
+            # Arrays still show their length (a single read)
+            value += '[%d]' % int(self.obj['__length__'])
+        except Exception:
+            pass
+        return SVMPrintBudget.truncated(value + ' @ 0x%x' % int(self.obj))
+
+
 class SVMPPString:
     def __init__(self, obj):
         # trace(' <SVMPPString>')
@@ -216,7 +1356,22 @@ class SVMPPString:
         return 'string'
 
     def to_string(self):
-        value = SVMUtil.get_javastr(self.obj)
+        budget = SVMPrintBudget.for_value()
+        if budget is None:
+            value = SVMUtil.get_javastr(self.obj)
+        elif budget.exhausted():
+            return SVMPrintBudget.truncated('java.lang.String @ 0x%x' % int(self.obj))
+        else:
+            try:
+                (value, read_bytes, truncated) = SVMUtil.read_javastr_prefix(int(self.obj), budget.remaining_bytes())
+                budget.charge(read_bytes)
+                if value is None:
+                    value = '<Invalid String>'
+                elif truncated:
+                    value = SVMPrintBudget.truncated(value + '...')
+            except Exception as e:
+                trace('<SVMPPString budget exception: %s>' % e)
+                value = SVMUtil.get_javastr(self.obj)
         if SVMUtil.with_addr:
             value += ' @ 0x%x' % int(self.obj)
         return value
@@ -231,7 +1386,7 @@ class SVMPPCString:
         return 'string'
 
     def to_string(self):
-        cstr = self.get_cstr(self.obj, None)
+        cstr = self.get_cstr(self.obj, None, SVMPrintBudget.for_value())
         if not cstr:
             return 'Invalid CString @ 0x%x' % int(self.obj)
         if SVMUtil.with_addr:
@@ -239,10 +1394,15 @@ class SVMPPCString:
         return cstr
 
     @staticmethod
-    def get_cstr(ptr_to_cstr, error_result='<Invalid String>'):
+    def get_cstr(ptr_to_cstr, error_result='<Invalid String>', budget=None):
         try:
             outstr = u''
             for i in range(SVMUtil.print_cstr_limit):
+                if budget is not None:
+                    if budget.exhausted():
+                        outstr = SVMPrintBudget.truncated(outstr + u'...')
+                        break
+                    budget.charge(1)
                 current_char = int(ptr_to_cstr.dereference()) & 0xff
                 if current_char == 0:
                     break
@@ -262,6 +1422,7 @@ class SVMPPArray:
         self.obj = obj
         self.selfref = SVMUtil.is_selfref(obj)
         self.length = length
+        self.budget = SVMPrintBudget.for_value()
         if not array:
             self.java = False
             self.array = obj
@@ -287,12 +1448,29 @@ class SVMPPArray:
 
     def __iter__(self):
         for i in range(int(self.length)):
-            yield self.array[i]
+            yield SVMUtil.decode_value(self.array[i])
+
+    def elem(self, index):
+        if index < 0 or index >= int(self.length):
+            return None
+        return SVMUtil.decode_value(self.array[index])
+
+    def elem_size(self):
+        try:
+            return self.array.type.strip_typedefs().target().sizeof
+        except Exception:
+            return 8
 
     def children(self):
         if self.selfref or SVMUtil.print_array_limit <= 0:
             return
+        elem_size = self.elem_size() if self.budget is not None else 0
         for index, elem in enumerate(self):
+            if self.budget is not None:
+                if self.budget.exhausted():
+                    yield (str(index), SVMPrintBudget.truncated('...'))
+                    break
+                self.budget.charge(elem_size)
             yield (str(index), SVMUtil.add_selfref(self.obj, elem))
             if index + 1 == SVMUtil.print_array_limit:
                 yield (str(index+1), '...')
@@ -310,7 +1488,7 @@ class SVMPPClass:
         return SVMUtil.get_rtt_name(self.obj)
 
     def __getitem__(self, key):
-        item = self.obj[key]
+        item = SVMUtil.decode_value(self.obj[key])
         ppitem = gdb.default_visualizer(item)
         return item if ppitem is None else ppitem
 
@@ -337,6 +1515,9 @@ class SVMPPClass:
                     continue
             if str(f.name) == SVMUtil.hub_fieldname:
                 continue
+            if SVMPrintBudget.active() and SVMPrintBudget.stop_exhausted():
+                yield ('...', SVMPrintBudget.truncated('...'))
+                return
             yield (str(f.name), SVMUtil.add_selfref(self.obj, self.obj[str(f.name)]))
 
 
@@ -382,6 +1563,9 @@ class SVMPrettyPrinter(gdb.printing.PrettyPrinter):
 
         try:
             # import pdb; pdb.set_trace()
+            # Widen compressed references before anything looks at the address
+            val = SVMUtil.decode_value(val)
+
             # Promote TYPEDEFs of runtime-compiled code to full types
             if val.type.code == gdb.TYPE_CODE_PTR:
                 target_type = val.type.target()
@@ -397,6 +1581,10 @@ class SVMPrettyPrinter(gdb.printing.PrettyPrinter):
             if int(val) == 0:
                 return SVMPPConst('null')
 
+            # Out of budget for this stop: do not read more than the array length
+            if SVMPrintBudget.active() and SVMPrintBudget.stop_exhausted():
+                return SVMPPTruncated(val)
+
             # Convert object to its runtime type object
             val = SVMUtil.cast_to_rtt(val)
 
@@ -488,20 +1676,421 @@ class ArrayList:
             if index >= self.size:
                 break
             yield elem
+    def elem(self, index):
+        return self.elementData.elem(index) if index < self.size else None
+    def children(self):
+        if SVMUtil.print_array_limit <= 0:
+            return
+        for index, elem in enumerate(self):
+            yield (str(index), SVMUtil.add_selfref(self.obj, elem))
+            if index + 1 == SVMUtil.print_array_limit:
+                yield (str(index + 1), '...')
+                break
+
+
+@HLRep
+class HashMap:
+    target_type = 'java.util.HashMap'
+    value_fieldname = 'value'
+    def __init__(self, pp):
+        self.obj = pp.obj
+        self.selfref = SVMUtil.is_selfref(self.obj)
+    def size(self):
+        return int(self.obj['size'])
+    def to_string(self):
+        res = self.target_type + '(' + str(self.size()) + ')'
+        if self.selfref:
+            res += ' = {...}'
+        if SVMUtil.with_addr:
+            res += ' @ 0x%x' % int(self.obj)
+        return res
+    def display_hint(self):
+        return 'map'
+    @staticmethod
+    def spread(hashcode):
+        return hashcode ^ (hashcode >> 16)
+    def bins(self, table):
+        if int(table) == 0:
+            return
+        array = table['__array__']
+        for index in range(int(table['__length__'])):
+            node = SVMUtil.decode_value(array[index])
+            if int(node) != 0:
+                yield node
+    def chain(self, node):
+        while int(node) != 0:
+            yield node
+            node = SVMUtil.decode_value(node['next'])
+    def __iter__(self):
+        for node in self.bins(SVMUtil.decode_value(self.obj['table'])):
+            for entry in self.chain(node):
+                yield (SVMUtil.decode_value(entry['key']), SVMUtil.decode_value(entry[self.value_fieldname]))
+    def children(self):
+        if self.selfref or SVMUtil.print_array_limit <= 0:
+            return
+        for index, (key, value) in enumerate(self):
+            yield ('[%d]' % index, SVMUtil.add_selfref(self.obj, key))
+            yield ('[%d]' % index, SVMUtil.add_selfref(self.obj, value))
+            if index + 1 == SVMUtil.print_array_limit:
+                yield ('[%d]' % (index + 1), '...')
+                yield ('[%d]' % (index + 1), '...')
+                break
+    def lookup_table(self, table, key, hashcode):
+        if int(table) == 0:
+            return None
+        node = SVMUtil.decode_value(table['__array__'][(int(table['__length__']) - 1) & hashcode])
+        for entry in self.chain(node):
+            entry_key = SVMUtil.decode_value(entry['key'])
+            if (int(entry['hash']) & 0xffffffff) == hashcode and SVMUtil.get_rtt_name(entry_key) == 'java.lang.String':
+                if SVMUtil.get_javastr(entry_key, None) == key:
+                    return entry
+        return None
+    def lookup_entry(self, key):
+        # Only the bucket chain for the Java hash of the key is read
+        return self.lookup_table(SVMUtil.decode_value(self.obj['table']), key, self.spread(SVMUtil.get_java_hashcode(key)))
+    def lookup(self, key):
+        entry = self.lookup_entry(key)
+        return None if entry is None else SVMUtil.decode_value(entry[self.value_fieldname])
+
+
+@HLRep
+class LinkedHashMap(HashMap):
+    target_type = 'java.util.LinkedHashMap'
+    def __iter__(self):
+        entry = SVMUtil.decode_value(self.obj['head'])
+        while int(entry) != 0:
+            yield (SVMUtil.decode_value(entry['key']), SVMUtil.decode_value(entry[self.value_fieldname]))
+            entry = SVMUtil.decode_value(entry['after'])
+
+
+@HLRep
+class ConcurrentHashMap(HashMap):
+    target_type = 'java.util.concurrent.ConcurrentHashMap'
+    value_fieldname = 'val'
+    MOVED = -1
+    TREEBIN = -2
+    def size(self):
+        size = int(self.obj['baseCount'])
+        counter_cells = SVMUtil.decode_value(self.obj['counterCells'])
+        if int(counter_cells) != 0:
+            array = counter_cells['__array__']
+            for index in range(int(counter_cells['__length__'])):
+                cell = SVMUtil.decode_value(array[index])
+                if int(cell) != 0:
+                    size += int(cell['value'])
+        return size
+    @staticmethod
+    def spread(hashcode):
+        return (hashcode ^ (hashcode >> 16)) & 0x7fffffff
+    def chain(self, node):
+        hashcode = int(node['hash'])
+        if hashcode == self.TREEBIN:
+            node = SVMUtil.decode_value(SVMUtil.cast_to_rtt(node)['first'])
+        elif hashcode == self.MOVED:
+            return
+        while int(node) != 0:
+            yield node
+            node = SVMUtil.decode_value(node['next'])
+    def __iter__(self):
+        table = SVMUtil.decode_value(self.obj['table'])
+        if int(table) == 0:
+            return
+        array = table['__array__']
+        length = int(table['__length__'])
+        for index in range(length):
+            node = SVMUtil.decode_value(array[index])
+            if int(node) == 0:
+                continue
+            if int(node['hash']) == self.MOVED:
+                # Bin transferred by a resize in progress, its entries are in two bins of the new table
+                next_array = SVMUtil.cast_to_rtt(SVMUtil.cast_to_rtt(node)['nextTable'])['__array__']
+                nodes = [SVMUtil.decode_value(next_array[index]), SVMUtil.decode_value(next_array[index + length])]
+            else:
+                nodes = [node]
+            for node in nodes:
+                if int(node) == 0:
+                    continue
+                for entry in self.chain(node):
+                    yield (SVMUtil.decode_value(entry['key']), SVMUtil.decode_value(entry[self.value_fieldname]))
+    def lookup_table(self, table, key, hashcode):
+        if int(table) == 0:
+            return None
+        node = SVMUtil.decode_value(table['__array__'][(int(table['__length__']) - 1) & hashcode])
+        if int(node) != 0 and int(node['hash']) == self.MOVED:
+            return self.lookup_table(SVMUtil.cast_to_rtt(SVMUtil.cast_to_rtt(node)['nextTable']), key, hashcode)
+        return super().lookup_table(table, key, hashcode)
+
+
+@HLRep
+class HashSet:
+    target_type = 'java.util.HashSet'
+    def __init__(self, pp):
+        self.obj = pp.obj
+        self.selfref = SVMUtil.is_selfref(self.obj)
+        self.map = makeHighLevelObject(SVMPPClass(SVMUtil.cast_to_rtt(self.obj['map'])))
+    def to_string(self):
+        res = self.target_type + '(' + str(self.map.size()) + ')'
+        if self.selfref:
+            res += ' = {...}'
+        if SVMUtil.with_addr:
+            res += ' @ 0x%x' % int(self.obj)
+        return res
+    def display_hint(self):
+        return 'array'
+    def __iter__(self):
+        for (key, _) in self.map:
+            yield key
+    def children(self):
+        if self.selfref or SVMUtil.print_array_limit <= 0:
+            return
+        for index, elem in enumerate(self):
+            yield (str(index), SVMUtil.add_selfref(self.obj, elem))
+            if index + 1 == SVMUtil.print_array_limit:
+                yield (str(index + 1), '...')
+                break
+    def lookup(self, key):
+        # The element itself (a java.lang.String), as stored as key in the backing map
+        entry = self.map.lookup_entry(key)
+        return None if entry is None else SVMUtil.decode_value(entry['key'])
+
+
+@HLRep
+class LinkedHashSet(HashSet):
+    target_type = 'java.util.LinkedHashSet'
+
+
+@HLRep
+class Tuple2:
+    target_type = 'scala.Tuple2'
+    fieldnames = ['_1', '_2']
+    def __init__(self, pp):
+        self.obj = pp.obj
+        self.selfref = SVMUtil.is_selfref(self.obj)
+        # Specialized tuples (e.g. scala.Tuple2$mcJD$sp) store their elements in fields like _1$mcJ$sp
+        fields = [str(f.name) for f in self.obj.type.target().fields() if hasattr(f, 'bitpos')]
+        self.elemnames = []
+        for name in self.fieldnames:
+            specialized = [f for f in fields if f.startswith(name + '$')]
+            self.elemnames.append(specialized[0] if specialized else name)
+    def to_string(self):
+        res = self.target_type
+        if self.selfref:
+            res += ' = {...}'
+        if SVMUtil.with_addr:
+            res += ' @ 0x%x' % int(self.obj)
+        return res
+    def display_hint(self):
+        return 'array'
+    def elem(self, index):
+        if index < 0 or index >= len(self.elemnames):
+            return None
+        return SVMUtil.unbox(SVMUtil.decode_value(self.obj[self.elemnames[index]]))
+    def children(self):
+        if self.selfref:
+            return
+        for index in range(len(self.elemnames)):
+            yield (self.fieldnames[index], SVMUtil.add_selfref(self.obj, self.elem(index)))
+
+
+@HLRep
+class KotlinPair(Tuple2):
+    target_type = 'kotlin.Pair'
+    fieldnames = ['first', 'second']
+
+
+@HLRep
+class ScalaList:
+    target_type = 'scala.collection.immutable.$colon$colon'
+    def __init__(self, pp):
+        self.obj = pp.obj
+        self.selfref = SVMUtil.is_selfref(self.obj)
+    def to_string(self):
+        res = 'scala.collection.immutable.List'
+        if self.selfref:
+            res += ' = {...}'
+        if SVMUtil.with_addr:
+            res += ' @ 0x%x' % int(self.obj)
+        return res
+    def display_hint(self):
+        return 'array'
+    def __iter__(self):
+        node = self.obj
+        while int(node) != 0 and SVMUtil.get_rtt_name(node) == self.target_type:
+            node = SVMUtil.cast_to_rtt(node)
+            yield SVMUtil.unbox(SVMUtil.decode_value(node['head']))
+            node = SVMUtil.decode_value(node['tl'])
+    def elem(self, index):
+        if index < 0:
+            return None
+        for elem_index, elem in enumerate(self):
+            if elem_index == index:
+                return elem
+        return None
+    def children(self):
+        if self.selfref or SVMUtil.print_array_limit <= 0:
+            return
+        for index, elem in enumerate(self):
+            yield (str(index), SVMUtil.add_selfref(self.obj, elem))
+            if index + 1 == SVMUtil.print_array_limit:
+                yield (str(index + 1), '...')
+                break
+
+
+@HLRep
+class ScalaNil(ScalaList):
+    target_type = 'scala.collection.immutable.Nil$'
+    def __iter__(self):
+        return iter(())
+
+
+@HLRep
+class ScalaVector:
+    target_type = 'scala.collection.immutable.Vector'
+    def __init__(self, pp):
+        self.obj = pp.obj
+        self.selfref = SVMUtil.is_selfref(self.obj)
+        self.start = int(self.obj['startIndex'])
+        self.size = int(self.obj['endIndex']) - self.start
+        self.depth = int(self.obj['depth'])
+        self.focus = int(self.obj['focus'])
+    def to_string(self):
+        res = self.target_type + '(' + str(self.size) + ')'
+        if self.selfref:
+            res += ' = {...}'
+        if SVMUtil.with_addr:
+            res += ' @ 0x%x' % int(self.obj)
+        return res
+    def display_hint(self):
+        return 'array'
+    def display(self, level):
+        return SVMUtil.cast_to_rtt(self.obj['display%d' % level])
+    def elem(self, index):
+        # Radix lookup in the 32-way trie: one array read per level
+        if index < 0 or index >= self.size or self.depth <= 0:
+            return None
+        index += self.start
+        node = self.display(self.depth - 1)
+        for level in range(self.depth - 1, 0, -1):
+            if index >> (5 * level) == self.focus >> (5 * level):
+                # Same subtree as the focus, use the cached path (also correct for dirty vectors)
+                node = self.display(level - 1)
+            else:
+                node = SVMUtil.cast_to_rtt(node['__array__'][(index >> (5 * level)) & 31])
+        return SVMUtil.unbox(SVMUtil.decode_value(node['__array__'][index & 31]))
+    def __iter__(self):
+        for index in range(self.size):
+            yield self.elem(index)
+    def children(self):
+        if self.selfref or SVMUtil.print_array_limit <= 0:
+            return
+        for index, elem in enumerate(self):
+            yield (str(index), SVMUtil.add_selfref(self.obj, elem))
+            if index + 1 == SVMUtil.print_array_limit:
+                yield (str(index + 1), '...')
+                break
+
+
+@HLRep
+class ScalaMap1:
+    target_type = 'scala.collection.immutable.Map$Map1'
+    size = 1
+    def __init__(self, pp):
+        self.obj = pp.obj
+        self.selfref = SVMUtil.is_selfref(self.obj)
+    def to_string(self):
+        res = 'scala.collection.immutable.Map(' + str(self.size) + ')'
+        if self.selfref:
+            res += ' = {...}'
+        if SVMUtil.with_addr:
+            res += ' @ 0x%x' % int(self.obj)
+        return res
+    def display_hint(self):
+        return 'map'
+    def __iter__(self):
+        for index in range(1, self.size + 1):
+            yield (SVMUtil.decode_value(self.obj['key%d' % index]), SVMUtil.decode_value(self.obj['value%d' % index]))
     def children(self):
-        if SVMUtil.print_array_limit <= 0:
+        if self.selfref or SVMUtil.print_array_limit <= 0:
             return
-        for index, elem in enumerate(self):
-            yield (str(index), SVMUtil.add_selfref(self.obj, elem))
+        for index, (key, value) in enumerate(self):
+            yield ('[%d]' % index, SVMUtil.add_selfref(self.obj, SVMUtil.unbox(key)))
+            yield ('[%d]' % index, SVMUtil.add_selfref(self.obj, SVMUtil.unbox(value)))
             if index + 1 == SVMUtil.print_array_limit:
-                yield (str(index + 1), '...')
+                yield ('[%d]' % (index + 1), '...')
+                yield ('[%d]' % (index + 1), '...')
                 break
+    def lookup(self, key):
+        # Keys are compared by their String content or by their unboxed value
+        for (entry_key, value) in self:
+            unboxed = SVMUtil.unbox(entry_key)
+            if unboxed.type.code == gdb.TYPE_CODE_PTR:
+                matches = SVMUtil.get_javastr(entry_key, None) == key
+            else:
+                matches = str(unboxed) == key
+            if matches:
+                return SVMUtil.unbox(value)
+        return None
+
+
+@HLRep
+class ScalaMap2(ScalaMap1):
+    target_type = 'scala.collection.immutable.Map$Map2'
+    size = 2
+
+
+@HLRep
+class ScalaMap3(ScalaMap1):
+    target_type = 'scala.collection.immutable.Map$Map3'
+    size = 3
+
+
+@HLRep
+class ScalaMap4(ScalaMap1):
+    target_type = 'scala.collection.immutable.Map$Map4'
+    size = 4
+
+
+@HLRep
+class ScalaHashTrieMap(ScalaMap1):
+    target_type = 'scala.collection.immutable.HashMap$HashTrieMap'
+    def __init__(self, pp):
+        super().__init__(pp)
+        self.size = int(self.obj['size0'])
+    def __iter__(self):
+        # Depth-first over the trie nodes, yielding leaves lazily
+        pending = [self.obj]
+        while pending:
+            node = SVMUtil.cast_to_rtt(pending.pop())
+            rttname = str(node.type)
+            if rttname == ScalaHashTrieMap.target_type:
+                elems = SVMUtil.decode_value(node['elems'])
+                array = elems['__array__']
+                pending.extend(SVMUtil.decode_value(array[index]) for index in range(int(elems['__length__']) - 1, -1, -1))
+            elif rttname == 'scala.collection.immutable.HashMap$HashMap1':
+                yield (SVMUtil.decode_value(node['key']), SVMUtil.decode_value(node['value']))
+            elif rttname == 'scala.collection.immutable.HashMap$HashMapCollision1':
+                entry = SVMUtil.cast_to_rtt(node['kvs'])
+                while int(entry) != 0 and str(entry.type) == 'scala.collection.immutable.ListMap$Node':
+                    yield (SVMUtil.decode_value(entry['key']), SVMUtil.decode_value(entry['value']))
+                    entry = SVMUtil.cast_to_rtt(entry['$outer'])
+
+
+@HLRep
+class ScalaHashMap1(ScalaHashTrieMap):
+    target_type = 'scala.collection.immutable.HashMap$HashMap1'
+    def __init__(self, pp):
+        ScalaMap1.__init__(self, pp)
+        self.size = 1
 
 
 def makeHighLevelObject(pp):
     try:
         trace('try makeHighLevelObject for ' + pp.rttname())
-        hlrepclass = SVMUtil.hlreps[pp.rttname()]
+        rttname = pp.rttname()
+        if rttname not in SVMUtil.hlreps and rttname.endswith('$sp'):
+            # Scala specialized subclass, e.g. scala.Tuple2$mcJD$sp
+            rttname = rttname.split('$mc')[0]
+        hlrepclass = SVMUtil.hlreps[rttname]
         return hlrepclass(pp)
     except Exception as e:
         trace('<makeHighLevelObject exception: %s>' % e)
@@ -562,6 +2151,23 @@ class SVMCommandPrintAddresses(gdb.Command):
 SVMCommandPrintAddresses()
 
 
+class SVMCommandIndexStatus(gdb.Command):
+    '''Use this command to show how far the background function and variable listings used by bb and completion are built'''
+    def __init__(self):
+        super().__init__('svm-index-status', gdb.COMMAND_STATUS)
+
+    def invoke(self, arg, from_tty):
+        for listing in SVMListing.listings:
+            if listing.generation == 0:
+                print('%s: not started' % listing.name)
+                continue
+            counts = ', '.join('%d %s' % (len(entries), kind) for (kind, entries) in sorted(listing.entries.items()))
+            done = len(SVMListing.slices) - len(listing.pending)
+            print('%s: %d/%d slices%s, %s' % (listing.name, done, len(SVMListing.slices),
+                                              ' (complete)' if listing.is_complete() else '', counts or 'no entries'))
+SVMCommandIndexStatus()
+
+
 class SVMCommandSelfref(gdb.Command):
     '''Use this command to enable/disable cycle detection for pretty printing'''
     def __init__(self):
@@ -651,6 +2257,7 @@ class SVMCommandCompleteStaticVariables(gdb.Command):
             print('svm-complete-static-variables is %s' % {True : 'enabled', False : 'disabled'}.get(SVMUtil.complete_svar))
         elif arg == 'on' or arg == 'enable':
             SVMUtil.complete_svar = True
+            SVMListing.variables.restart()
         else:
             SVMUtil.complete_svar = False
 SVMCommandCompleteStaticVariables()
@@ -678,12 +2285,32 @@ class SVMCommandCompleteDebugTrace(gdb.Command):
 SVMCommandCompleteDebugTrace()
 
 
+class SVMCommandBacktraceCompact(gdb.Command):
+    '''Use this command to enable/disable collapsing recursive frames in backtraces into one counted line'''
+    def __init__(self):
+        super().__init__('svm-bt-compact', gdb.COMMAND_USER)
+
+    def complete(self, text, word):
+        return [x for x in ['enable', 'disable'] if x.startswith(text)]
+
+    def invoke(self, arg, from_tty):
+        if arg == '':
+            print('svm-bt-compact is %s' % {True : 'enabled', False : 'disabled'}.get(SVMUtil.bt_compact))
+        elif arg == 'on' or arg == 'enable':
+            SVMUtil.bt_compact = True
+        else:
+            SVMUtil.bt_compact = False
+SVMCommandBacktraceCompact()
+
+
 class SVMCommandPrettyPrint(gdb.Command):
     '''Use this command for SVM pretty printing'''
     def __init__(self):
         super().__init__('pp', gdb.COMMAND_DATA)
         self.last = None
         self.svar_cache = None
+        self.svar_generation = None
+        self.svar_count = 0
 
     @staticmethod
     def fetchfields(value):
@@ -714,7 +2341,12 @@ class SVMCommandPrettyPrint(gdb.Command):
             parts = (sep + after).split('][')
             try:
                 for part in parts:
-                    indices.append(int(part.strip('[]')))
+                    part = part.strip('[]')
+                    if len(part) >= 2 and part[0] == part[-1] and part[0] in '"\'':
+                        # Key lookup in maps (see HashMap.lookup)
+                        indices.append(part[1:-1])
+                    else:
+                        indices.append(int(part))
             except:
                 indices = []
         trace('splitindex result (%s, %s)' % (identifier, indices))
@@ -732,6 +2364,16 @@ class SVMCommandPrettyPrint(gdb.Command):
                 value = None
                 if valuepp == None:
                     return None
+                if isinstance(index, str):
+                    trace('<getelem for key "%s" of: %s>' % (index, valuepp.__class__.__name__))
+                    if not hasattr(valuepp, 'lookup'):
+                        valuepp = makeHighLevelObject(valuepp)
+                    value = valuepp.lookup(index)
+                    continue
+                if hasattr(valuepp, 'elem'):
+                    trace('<getelem for index %d via elem of: %s>' % (index, valuepp.__class__.__name__))
+                    value = valuepp.elem(index)
+                    continue
                 trace('<getelem for index %d fetch children of: %s>' % (index, valuepp.__class__.__name__))
                 children = valuepp.children()
                 for (elemname, elemvalue) in children:
@@ -805,15 +2447,15 @@ class SVMCommandPrettyPrint(gdb.Command):
             return []
 
         trace("svar_complete for '%s'" % text)
-        if not self.svar_cache:
+        listing = SVMListing.variables
+        if not self.svar_cache or self.svar_generation != listing.generation:
             trace('building svar_cache')
             self.svar_cache = ('root', [])
-            output = gdb.execute('info variables', False, True)
-            for line in output.split('\n'):
-                if not line.startswith('static '):
-                    continue
-                startpos = line.rfind(' ')
-                staticvarname = line[startpos + 1:-1]
+            (self.svar_generation, self.svar_count) = (listing.generation, 0)
+        # Add the variables collected since the last completion (the listing is built in the background)
+        staticvarnames = listing.collected('variable')
+        if self.svar_count < len(staticvarnames):
+            for staticvarname in staticvarnames[self.svar_count:]:
                 currentnode = self.svar_cache
                 for part in staticvarname.split('.'):
                     found = None
@@ -827,6 +2469,7 @@ class SVMCommandPrettyPrint(gdb.Command):
                         newnode = (part, [])
                         currentnode[1].append(newnode)
                         currentnode = newnode
+            self.svar_count = len(staticvarnames)
 
         candidates = []
         try:
@@ -945,27 +2588,100 @@ class SVMCommandPrettyPrint(gdb.Command):
 
             return []
 
+    @staticmethod
+    def print_settings():
+        settings = {'pretty': False, 'array': False, 'elements': None, 'max-depth': None}
+        for name in settings:
+            try:
+                settings[name] = gdb.parameter('print ' + name)
+            except Exception as e:
+                trace('<print_settings exception: %s>' % e)
+        return settings
+
+    @staticmethod
+    def quote(text):
+        return '"' + text.replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n').replace('\t', '\\t') + '"'
+
+    @staticmethod
+    def render(value, settings, depth=0):
+        '''Writes value the way gdb prints it, but emits each child as soon as it is produced'''
+        if isinstance(value, str):
+            gdb.write(value)
+            return
+        ppobj = value
+        if isinstance(value, gdb.Value):
+            ppobj = gdb.default_visualizer(value)
+            if ppobj is None:
+                gdb.write(str(value))
+                return
+        hint = ppobj.display_hint() if hasattr(ppobj, 'display_hint') else None
+        text = ppobj.to_string() if hasattr(ppobj, 'to_string') else None
+        if isinstance(text, gdb.Value):
+            text = str(text)
+        if text is not None:
+            gdb.write(SVMCommandPrettyPrint.quote(text) if hint == 'string' else text)
+        if not hasattr(ppobj, 'children'):
+            return
+        max_depth = settings['max-depth']
+        elements = settings['elements']
+        is_map = hint == 'map'
+        # Like print_children, arrays follow `print array` and everything else `print pretty`
+        pretty = settings['array'] if hint == 'array' else settings['pretty']
+        indent = '\n' + '  ' * (depth + 1)
+        children = ppobj.children()
+        if elements is not None:
+            # Like gdb's print_children, the limit counts every child (map keys and values alike)
+            children = itertools.islice(children, elements)
+        count = 0
+        for (index, (name, child)) in enumerate(children):
+            count = index + 1
+            if index == 0:
+                if max_depth is not None and depth >= max_depth:
+                    gdb.write(('' if text is None else ' = ') + '{...}')
+                    return
+                gdb.write(('' if text is None else ' = ') + '{')
+            elif not is_map or index % 2 == 0:
+                gdb.write(',' if pretty else ', ')
+            if pretty and (not is_map or index % 2 == 0):
+                gdb.write(indent)
+            if is_map:
+                if index % 2 == 0:
+                    gdb.write('[')
+                    SVMCommandPrettyPrint.render(child, settings, depth + 1)
+                    gdb.write('] = ')
+                    continue
+            elif hint != 'array':
+                gdb.write(name + ' = ')
+            SVMCommandPrettyPrint.render(child, settings, depth + 1)
+            gdb.flush()
+        if count == 0:
+            return
+        if count == elements:
+            gdb.write((indent if pretty else '') + '...')
+        gdb.write(('\n' + '  ' * depth if pretty else '') + '}')
+
     def invoke(self, arg, from_tty):
         try:
-            with SVMCommandPrettyPrint.lookup_scope():
-                res = self.resolve(arg)
-            self.svar_cache = None
-            if res != None:
-                self.last = res
-                print(str(res))
-            else:
-                print('No Java debug-expression "%s" in current context.' % arg)
+            with SVMUtil.selfref_scope():
+                with SVMCommandPrettyPrint.lookup_scope():
+                    res = self.resolve(arg)
+                if res != None:
+                    self.last = res
+                    SVMCommandPrettyPrint.render(res, SVMCommandPrettyPrint.print_settings())
+                    gdb.write('\n')
+                else:
+                    print('No Java debug-expression "%s" in current context.' % arg)
         except KeyboardInterrupt:
-            pass
-SVMCommandPrettyPrint()
+            gdb.write('\n')
+SVMUtil.pp_command = SVMCommandPrettyPrint()
 
 
 class SVMCommandBreak(gdb.Command):
     '''Use this command for setting breakpoints'''
     def __init__(self):
         super().__init__('bb', gdb.COMMAND_BREAKPOINTS)
-        self.breakpoints = None
-        self.first_use = True
+        self.addresses = dict()
+        self.created = dict()
 
     def normalize(self, text):
         text = text.lower()
@@ -973,25 +2689,9 @@ class SVMCommandBreak(gdb.Command):
         return text
 
     def findmatch(self, search_text):
-        if self.breakpoints is None:
-            if self.first_use:
-                print('Collecting functions for the first time. Please wait...', end='', flush=True)
-            self.breakpoints = []
-            for line in gdb.execute('info functions', False, True).split('\n'):
-                if not line.startswith('static '):
-                    continue
-                if line.startswith('static CPointer') or line.startswith('static CStruct'):
-                    beginpos = line.find(' ', 14) + 1 # find end of CPointer/CStruct part
-                else:
-                    beginpos = 7 # startpos for whitespace search
-                # strip C-style return value declaration and append
-                bp_entry = line[line.find(' ', beginpos):].lstrip(' []*').rstrip(' ;')
-                self.breakpoints.append(bp_entry)
-            if self.first_use:
-                print(' DONE.')
-                self.first_use = False
-
-        return (match for match in self.breakpoints if self.normalize(search_text) in self.normalize(match.split('(')[0]))
+        # Matches from the part of the function listing built so far come first
+        search_text = self.normalize(search_text)
+        return (match for match in SVMListing.functions.iter_entries('function') if search_text in self.normalize(match.split('(')[0]))
 
     @staticmethod
     @contextmanager
@@ -1000,6 +2700,88 @@ class SVMCommandBreak(gdb.Command):
         yield
         gdb.execute('set pagination on')
 
+    @staticmethod
+    @contextmanager
+    def pending_on():
+        # Like gdb.Breakpoint, make unknown functions pending breakpoints instead of asking
+        pending = gdb.parameter('breakpoint pending')
+        gdb.execute('set breakpoint pending on')
+        try:
+            yield
+        finally:
+            gdb.execute('set breakpoint pending %s' % {True: 'on', False: 'off'}.get(pending, 'auto'))
+
+    @staticmethod
+    def create_breakpoint(spec):
+        # gdb.Breakpoint announces every breakpoint it creates; the output of a captured break command is dropped
+        newest = max([bp.number for bp in gdb.breakpoints() or ()] + [0])
+        gdb.execute('break ' + spec, False, True)
+        created = [bp for bp in gdb.breakpoints() or () if bp.number > newest]
+        if not created:
+            raise gdb.error('No breakpoint created at ' + spec)
+        return created[0]
+
+    @staticmethod
+    def skip_prologue(address):
+        # decode_line returns the function entry; break FUNCTION stops after the prologue, which
+        # is the address range of the first line. Stay at the entry if that range is not usable.
+        sal = gdb.find_pc_line(address)
+        last = getattr(sal, 'last', None)
+        if sal.symtab is None or sal.pc != address or last is None:
+            return address
+        block = gdb.block_for_pc(address)
+        while block is not None and block.function is None:
+            block = block.superblock
+        if block is None or last + 1 >= block.end:
+            return address
+        return last + 1
+
+    def resolve_addresses(self, entries):
+        # Resolve each function only once; decode_line neither creates breakpoints nor prints
+        for entry in entries:
+            if entry in self.addresses:
+                continue
+            address = None
+            try:
+                (_, sals) = gdb.decode_line("'{}'".format(entry))
+                if sals and len(sals) == 1:
+                    address = SVMCommandBreak.skip_prologue(sals[0].pc)
+            except gdb.error as e:
+                trace('<bb resolve_addresses exception: %s>' % e)
+            self.addresses[entry] = address
+
+    def set_breakpoints(self, entries):
+        self.resolve_addresses(entries)
+        (count, by_address) = (0, 0)
+        with SVMCommandBreak.pagination_off(), SVMCommandBreak.pending_on():
+            for entry in entries:
+                bp = self.created.get(entry)
+                if bp is not None and bp.is_valid():
+                    continue
+                address = self.addresses[entry]
+                try:
+                    if address is not None:
+                        bp = SVMCommandBreak.create_breakpoint('*0x{:x}'.format(address))
+                        by_address += 1
+                    else:
+                        bp = SVMCommandBreak.create_breakpoint("'{}'".format(entry))
+                except gdb.error as e:
+                    print('Cannot set breakpoint for {}: {}'.format(entry, e))
+                    continue
+                self.created[entry] = bp
+                count += 1
+        print('Set {} breakpoint{} ({} by address, {} already set)'.format(
+            count, '' if count == 1 else 's', by_address, len(entries) - count))
+
+    def delete_breakpoints(self, entries):
+        count = 0
+        for entry in entries:
+            bp = self.created.pop(entry, None)
+            if bp is not None and bp.is_valid():
+                bp.delete()
+                count += 1
+        print('Deleted {} breakpoint{}'.format(count, '' if count == 1 else 's'))
+
     def invoke(self, arg, from_tty):
         try:
             gdb.execute('tui disable')
@@ -1027,26 +2809,27 @@ class SVMCommandBreak(gdb.Command):
                         print('  bb> -1')
                         print('Any python array indexing/slicing is allowed:')
                         print('  bb> : (make breakpoints for all search results)')
-                        print('  bb> 3:5 (make breakpoints for search result 3 and 4)\n')
+                        print('  bb> 3:5 (make breakpoints for search result 3 and 4)')
+                        print('Prefix a selection with d to delete the breakpoints bb set for it:')
+                        print('  bb> d: (delete breakpoints for all search results)\n')
                         continue
                     if index_or_substr == ':r':
                         print('Reset function lookup list')
-                        self.breakpoints = None
+                        SVMListing.functions.restart()
+                        self.addresses.clear()
                         continue
                     break
                 if index_or_substr == ':q':
-                    self.breakpoints = None
                     return
                 try:
-                    breakpoints = eval('options[' + index_or_substr + ']')
+                    delete = index_or_substr.startswith('d')
+                    breakpoints = eval('options[' + (index_or_substr[1:] if delete else index_or_substr) + ']')
                     if isinstance(breakpoints, str):
-                        print('Setting breakpoint for {}'.format(breakpoints))
-                        gdb.execute("break '{}'".format(breakpoints))
+                        breakpoints = [breakpoints]
+                    if delete:
+                        self.delete_breakpoints(breakpoints)
                     else:
-                        with SVMCommandBreak.pagination_off():
-                            for bp in breakpoints:
-                                print('Setting breakpoint for {}'.format(bp))
-                                gdb.execute("break '{}'".format(bp))
+                        self.set_breakpoints(breakpoints)
                     return
                 except:
                     arg = index_or_substr
@@ -1056,6 +2839,866 @@ class SVMCommandBreak(gdb.Command):
 SVMCommandBreak()
 
 
+class SVMArgumentParser(argparse.ArgumentParser):
+    '''Argument parser for svm-* commands that reports errors to gdb instead of exiting'''
+    def __init__(self, prog):
+        super().__init__(prog=prog, add_help=False)
+
+    def error(self, message):
+        raise gdb.GdbError('%s: %s' % (self.prog, message))
+
+    def parse_gdb_args(self, arg):
+        return self.parse_args(gdb.string_to_argv(arg))
+
+
+class SVMCommandDump(gdb.Command):
+    '''Use this command to export the object graph reachable from a Java expression as JSON lines
+Usage: svm-dump <expr> <file> [--depth N] [--max-objects N]
+Each line of <file> is one object with its address, runtime type, size and fields or array elements.
+References are written as hex address strings, null references as null.'''
+    def __init__(self):
+        super().__init__('svm-dump', gdb.COMMAND_DATA)
+        self.parser = SVMArgumentParser('svm-dump')
+        self.parser.add_argument('expr')
+        self.parser.add_argument('file')
+        self.parser.add_argument('--depth', type=int, default=2**31)
+        self.parser.add_argument('--max-objects', type=int, default=100000)
+
+    @staticmethod
+    def ref(addr):
+        return hex(addr) if addr else None
+
+    @staticmethod
+    def write_object(out, addr, depth, enqueue):
+        layout = SVMLayout.of_object(addr)
+        if layout is None:
+            out.write(json.dumps({'address': hex(addr), 'depth': depth, 'error': 'unknown hub'}) + '\n')
+            return
+        header = SVMUtil.read_memory(addr, layout.header_size)
+        record = {'address': hex(addr), 'type': layout.typename, 'depth': depth}
+        fields = dict()
+        for (name, value, is_ref) in layout.decode(header):
+            if is_ref:
+                enqueue(value)
+                value = SVMCommandDump.ref(value)
+            fields[name] = value
+        if layout.typename == 'java.lang.String':
+            record['string'] = SVMUtil.read_javastr(addr)
+        if not layout.is_array():
+            record['size'] = layout.object_size()
+            record['fields'] = fields
+            out.write(json.dumps(record) + '\n')
+            return
+
+        length = layout.array_length(header)
+        record['size'] = layout.object_size(length)
+        record['length'] = length
+        if not layout.elem_format:
+            out.write(json.dumps(record) + '\n')
+            return
+        # Stream the elements chunk by chunk so that huge arrays never live in memory as a whole
+        out.write(json.dumps(record)[:-1] + ', "elements": [')
+        sep = ''
+        for values in layout.iter_elements(addr, length):
+            if layout.elem_is_ref:
+                for value in values:
+                    enqueue(value)
+                values = [SVMCommandDump.ref(value) for value in values]
+            out.write(sep + json.dumps(values)[1:-1])
+            sep = ', '
+        out.write(']}\n')
+
+    def dump(self, root, out, max_depth, max_objects):
+        seen = set([root])
+        pending = collections.deque([(root, 0)])
+        count = 0
+        while pending:
+            (addr, depth) = pending.popleft()
+
+            def enqueue(child):
+                if child and depth < max_depth and len(seen) < max_objects and child not in seen:
+                    seen.add(child)
+                    pending.append((child, depth + 1))
+
+            try:
+                SVMCommandDump.write_object(out, addr, depth, enqueue)
+            except gdb.MemoryError as e:
+                out.write(json.dumps({'address': hex(addr), 'depth': depth, 'error': str(e)}) + '\n')
+            count += 1
+        return count
+
+    def invoke(self, arg, from_tty):
+        args = self.parser.parse_gdb_args(arg)
+        root = SVMUtil.resolve_address(args.expr)
+        if not root:
+            raise gdb.GdbError('svm-dump: "%s" is null' % args.expr)
+        count = 0
+        with open(args.file, 'w') as out:
+            try:
+                count = self.dump(root, out, args.depth, args.max_objects)
+            except KeyboardInterrupt:
+                print('Interrupted.')
+        print('Dumped %d objects to %s' % (count, args.file))
+SVMCommandDump()
+
+
+class SVMCommandExportArray(gdb.Command):
+    '''Use this command to write the elements of a Java primitive array to a file
+Usage: svm-export-array <expr> <file> [--format raw|npy]
+The raw format contains only the little-endian element data, npy adds a NumPy header with the element dtype.'''
+    npy_dtypes = {'?': '|b1', 'b': '|i1', 'H': '<u2', 'h': '<i2', 'i': '<i4', 'q': '<i8', 'f': '<f4', 'd': '<f8'}
+    chunk_size = 1 << 20
+
+    def __init__(self):
+        super().__init__('svm-export-array', gdb.COMMAND_DATA)
+        self.parser = SVMArgumentParser('svm-export-array')
+        self.parser.add_argument('expr')
+        self.parser.add_argument('file')
+        self.parser.add_argument('--format', choices=['raw', 'npy'], default='raw')
+
+    @staticmethod
+    def npy_header(dtype, length):
+        header = "{'descr': '%s', 'fortran_order': False, 'shape': (%d,), }" % (dtype, length)
+        # Magic, version 1.0 and header length; the header is padded so that the data is 64-byte aligned
+        prefix_len = 10
+        header += ' ' * (63 - (prefix_len + len(header)) % 64) + '\n'
+        return b'\x93NUMPY\x01\x00' + struct.pack('<H', len(header)) + header.encode('latin-1')
+
+    def invoke(self, arg, from_tty):
+        args = self.parser.parse_gdb_args(arg)
+        addr = SVMUtil.resolve_address(args.expr)
+        layout = SVMLayout.of_object(addr) if addr else None
+        if layout is None or not layout.is_array():
+            raise gdb.GdbError('svm-export-array: "%s" is not a Java array' % args.expr)
+        dtype = None if layout.elem_is_ref else SVMCommandExportArray.npy_dtypes.get(layout.elem_format)
+        if dtype is None:
+            raise gdb.GdbError('svm-export-array: %s is not a primitive array' % layout.typename)
+
+        length = layout.array_length(SVMUtil.read_memory(addr, layout.header_size))
+        data_addr = addr + layout.array_offset
+        data_size = length * layout.elem_size
+        with open(args.file, 'wb') as out:
+            if args.format == 'npy':
+                out.write(SVMCommandExportArray.npy_header(dtype, length))
+            try:
+                for offset in range(0, data_size, SVMCommandExportArray.chunk_size):
+                    out.write(SVMUtil.read_memory(data_addr + offset, min(SVMCommandExportArray.chunk_size, data_size - offset)))
+            except KeyboardInterrupt:
+                print('Interrupted.')
+                return
+        print('Exported %s[%d] (%d bytes) to %s' % (layout.typename[:-2], length, data_size, args.file))
+SVMCommandExportArray()
+
+
+class SVMCommandHistogram(gdb.Command):
+    '''Use this command to print a class histogram (instance count and bytes per type) of the image heap and runtime heap
+Usage: svm-histo [--sort bytes|count|name] [--top N] [--json FILE]
+With --json all entries are also written to FILE as a JSON list of {"type", "instances", "bytes"} objects.'''
+    def __init__(self):
+        super().__init__('svm-histo', gdb.COMMAND_DATA)
+        self.parser = SVMArgumentParser('svm-histo')
+        self.parser.add_argument('--sort', choices=['bytes', 'count', 'name'], default='bytes')
+        self.parser.add_argument('--top', type=int, default=20)
+        self.parser.add_argument('--json')
+
+    @staticmethod
+    def progress(done, total):
+        gdb.write('\rScanning heap: %3d%%' % (100 * done // max(total, 1)))
+        gdb.flush()
+
+    @staticmethod
+    def collect(ranges):
+        histogram = dict()
+        total = sum(end - start for (start, end, _) in ranges)
+        done = 0
+        for (start, end, _) in ranges:
+            next_report = start + SVMHeap.block_size
+            try:
+                for (addr, layout, size) in SVMHeap.objects(start, end):
+                    entry = histogram.get(layout.typename)
+                    if entry is None:
+                        histogram[layout.typename] = entry = [0, 0]
+                    entry[0] += 1
+                    entry[1] += size
+                    if addr >= next_report:
+                        SVMCommandHistogram.progress(done + addr - start, total)
+                        next_report += SVMHeap.block_size
+            except gdb.MemoryError as e:
+                trace('<svm-histo exception: %s>' % e)
+            done += end - start
+            SVMCommandHistogram.progress(done, total)
+        gdb.write('\n')
+        return histogram
+
+    @staticmethod
+    def sorted_entries(histogram, sort):
+        entries = [(typename, count, size) for (typename, (count, size)) in histogram.items()]
+        if sort == 'name':
+            return sorted(entries)
+        key_index = 1 if sort == 'count' else 2
+        return sorted(entries, key=lambda entry: entry[key_index], reverse=True)
+
+    def invoke(self, arg, from_tty):
+        args = self.parser.parse_gdb_args(arg)
+        ranges = SVMHeap.get_ranges()
+        if not ranges:
+            raise gdb.GdbError('svm-histo: no heap ranges found')
+        try:
+            histogram = SVMCommandHistogram.collect(ranges)
+        except KeyboardInterrupt:
+            print('\nInterrupted.')
+            return
+        entries = SVMCommandHistogram.sorted_entries(histogram, args.sort)
+        if args.json:
+            with open(args.json, 'w') as out:
+                json.dump([{'type': typename, 'instances': count, 'bytes': size} for (typename, count, size) in entries], out)
+        print('{:>6} {:>12} {:>14}  {}'.format('#', 'instances', 'bytes', 'type'))
+        for (index, (typename, count, size)) in enumerate(entries):
+            if args.top and index >= args.top:
+                print('{:>6}  ... {} more types'.format('', len(entries) - index))
+                break
+            print('{:>6} {:>12} {:>14}  {}'.format(index, count, size, typename))
+        print('{:>6} {:>12} {:>14}'.format('total', sum(e[1] for e in entries), sum(e[2] for e in entries)))
+SVMCommandHistogram()
+
+
+class SVMCommandFindRefs(gdb.Command):
+    '''Use this command to find all heap objects referencing the given object
+Usage: svm-find-refs <address|expr> [--max N]'''
+    def __init__(self):
+        super().__init__('svm-find-refs', gdb.COMMAND_DATA)
+        self.parser = SVMArgumentParser('svm-find-refs')
+        self.parser.add_argument('expr')
+        self.parser.add_argument('--max', type=int, default=100)
+
+    def invoke(self, arg, from_tty):
+        args = self.parser.parse_gdb_args(arg)
+        target = SVMUtil.resolve_address(args.expr)
+        if not target:
+            raise gdb.GdbError('svm-find-refs: "%s" is null' % args.expr)
+        try:
+            hits = SVMHeap.find_refs([target], args.max)
+        except KeyboardInterrupt:
+            print('Interrupted.')
+            return
+        for (slot, _, addr, layout, name) in hits:
+            print('0x%x: %s%s @ 0x%x' % (slot, layout.typename, name, addr))
+        print('%d reference%s to 0x%x found' % (len(hits), '' if len(hits) == 1 else 's', target))
+SVMCommandFindRefs()
+
+
+class SVMCommandFindString(gdb.Command):
+    '''Use this command to search the heap for java.lang.String instances containing the given text
+Usage: svm-find-string <text> [--regex] [--max N]
+       svm-find-string --resume (continue an interrupted search)'''
+    max_refs_lookup = 20
+    # Longer value arrays are taken as a sign that a hub match is not a String header
+    max_string_length = 1 << 24
+
+    def __init__(self):
+        super().__init__('svm-find-string', gdb.COMMAND_DATA)
+        self.parser = SVMArgumentParser('svm-find-string')
+        self.parser.add_argument('text', nargs='?')
+        self.parser.add_argument('--regex', action='store_true')
+        self.parser.add_argument('--max', type=int, default=20)
+        self.parser.add_argument('--resume', action='store_true')
+        self.search = None
+
+    @staticmethod
+    def string_hub_needles():
+        # Every hub has a java.lang.String name, so the String hub can be found from any object
+        (start, _, _) = SVMHeap.get_ranges()[0]
+        hub = SVMUtil.read_hub(start)
+        name = SVMLayout.of_object(hub).decode_dict(SVMUtil.read_memory(hub, SVMLayout.of_object(hub).header_size))['name']
+        string_hub = SVMUtil.read_hub(name)
+        # The hub of the byte[]/char[] that holds the contents of every String
+        str_layout = SVMLayout.for_typename('java.lang.String')
+        value_hub = SVMUtil.read_hub(str_layout.decode_dict(SVMUtil.read_memory(name, str_layout.header_size))['value'])
+        object_layout = SVMLayout.for_typename('java.lang.Object')
+        # The reserved bits of the hub slot are used for flags (see SVMUtil.get_hub)
+        encoding = SVMUtil.get_ref_encoding()
+        encoded_hub = SVMUtil.encode_ref(string_hub, encoding)
+        reserved_bits = encoding[2]
+        return [(encoded_hub | flags).to_bytes(object_layout.hub_size, 'little')
+                for flags in range(reserved_bits + 1) if flags & ~reserved_bits == 0], object_layout, value_hub
+
+    @staticmethod
+    def is_string(addr, value_hub):
+        '''Checks that a String hub match at addr is a String header and not e.g. a field holding String.class'''
+        str_layout = SVMLayout.for_typename('java.lang.String')
+        value_addr = str_layout.decode_dict(SVMUtil.read_memory(addr, str_layout.header_size))['value']
+        if not value_addr or SVMUtil.read_hub(value_addr) != value_hub:
+            return False
+        array_layout = SVMLayout.for_typename(str_layout.ref_types['value'])
+        length = array_layout.array_length(SVMUtil.read_memory(value_addr, array_layout.header_size))
+        return 0 <= length <= SVMCommandFindString.max_string_length
+
+    def new_search(self, args):
+        if not args.text:
+            raise gdb.GdbError('svm-find-string: missing text')
+        if args.regex:
+            matcher = re.compile(args.text).search
+        else:
+            matcher = lambda javastr: args.text in javastr
+        (needles, object_layout, value_hub) = SVMCommandFindString.string_hub_needles()
+        self.search = {
+            'text': args.text, 'matcher': matcher, 'max': args.max,
+            'needles': needles, 'hub_offset': object_layout.hub_offset, 'slot_size': object_layout.hub_size, 'value_hub': value_hub,
+            'ranges': SVMHeap.get_ranges(), 'range_index': 0, 'position': None, 'matches': dict(),
+        }
+
+    def scan(self):
+        search = self.search
+        ranges = search['ranges']
+        while search['range_index'] < len(ranges):
+            (start, end, _) = ranges[search['range_index']]
+            position = search['position'] or start
+            while position < end:
+                block_end = min(end, position + SVMHeap.block_size)
+                for (slot, _) in SVMHeap.find_slots(position, block_end, search['needles'], search['slot_size']):
+                    addr = slot - search['hub_offset']
+                    if addr in search['matches']:
+                        # Already reported before an interrupt inside this block
+                        continue
+                    try:
+                        if not SVMCommandFindString.is_string(addr, search['value_hub']):
+                            continue
+                        javastr = SVMUtil.read_javastr(addr)
+                    except Exception as e:
+                        trace('<svm-find-string candidate 0x%x: %s>' % (addr, e))
+                        continue
+                    if javastr is not None and search['matcher'](javastr):
+                        search['matches'][addr] = javastr
+                        if len(search['matches']) <= search['max']:
+                            print('0x%x: "%s"' % (addr, javastr if len(javastr) <= 80 else javastr[:80] + '...'))
+                # The search resumes at the next block after an interrupt
+                position = search['position'] = block_end
+            search['range_index'] += 1
+            search['position'] = None
+
+    def invoke(self, arg, from_tty):
+        args = self.parser.parse_gdb_args(arg)
+        if args.resume:
+            if self.search is None:
+                raise gdb.GdbError('svm-find-string: no interrupted search to resume')
+            print('Resuming search for "%s"' % self.search['text'])
+        else:
+            self.new_search(args)
+        try:
+            self.scan()
+        except KeyboardInterrupt:
+            print('Interrupted after %d matches. Use svm-find-string --resume to continue.' % len(self.search['matches']))
+            return
+        matches = self.search['matches']
+        self.search = None
+        print('%d matching string%s found' % (len(matches), '' if len(matches) == 1 else 's'))
+        if matches and len(matches) <= SVMCommandFindString.max_refs_lookup:
+            try:
+                for (_, target, addr, layout, name) in SVMHeap.find_refs(list(matches)):
+                    print('0x%x referenced from %s%s @ 0x%x' % (target, layout.typename, name, addr))
+            except KeyboardInterrupt:
+                print('Interrupted.')
+SVMCommandFindString()
+
+
+class SVMCommandSizeof(gdb.Command):
+    '''Use this command to compute the shallow and retained size of a Java object
+Usage: svm-sizeof <address|expr> [--retained] [--max-objects N] [--top N]
+The retained size is the size of all objects dominated by the given object within the graph reachable from it.
+Image heap objects are only counted if the object itself lives in the image heap.'''
+    def __init__(self):
+        super().__init__('svm-sizeof', gdb.COMMAND_DATA)
+        self.parser = SVMArgumentParser('svm-sizeof')
+        self.parser.add_argument('expr')
+        self.parser.add_argument('--retained', action='store_true')
+        self.parser.add_argument('--max-objects', type=int, default=1000000)
+        self.parser.add_argument('--top', type=int, default=10)
+
+    @staticmethod
+    def object_refs(addr):
+        layout = SVMLayout.of_object(addr)
+        if layout is None:
+            return None, 0, []
+        header = SVMUtil.read_memory(addr, layout.header_size)
+        refs = [value for (_, value, is_ref) in layout.decode(header) if is_ref and value]
+        length = layout.array_length(header)
+        if layout.is_array() and layout.elem_is_ref:
+            for values in layout.iter_elements(addr, length):
+                refs.extend(value for value in values if value)
+        return layout, layout.object_size(length), refs
+
+    @staticmethod
+    def walk(root, max_objects, skip):
+        '''Returns the reachable objects in BFS order with their sizes and successor indices'''
+        index = {root: 0}
+        addrs = [root]
+        layouts = []
+        sizes = []
+        succs = []
+        truncated = False
+        unreadable = 0
+        while len(sizes) < len(addrs):
+            try:
+                (layout, size, refs) = SVMCommandSizeof.object_refs(addrs[len(sizes)])
+            except gdb.MemoryError as e:
+                # Dangling or unreadable reference: keep it as an empty leaf
+                trace('<svm-sizeof exception: %s>' % e)
+                (layout, size, refs) = (None, 0, [])
+                unreadable += 1
+            children = []
+            for ref in refs:
+                child = index.get(ref)
+                if child is None:
+                    if skip(ref):
+                        continue
+                    if len(addrs) >= max_objects:
+                        truncated = True
+                        continue
+                    child = index[ref] = len(addrs)
+                    addrs.append(ref)
+                children.append(child)
+            layouts.append(layout)
+            sizes.append(size)
+            succs.append(children)
+        return addrs, layouts, sizes, succs, truncated, unreadable
+
+    @staticmethod
+    def dominators(succs):
+        '''Immediate dominators and postorder of a graph rooted at node 0 (Cooper, Harvey, Kennedy)'''
+        count = len(succs)
+        order = []
+        visited = [False] * count
+        visited[0] = True
+        stack = [(0, iter(succs[0]))]
+        while stack:
+            (node, children) = stack[-1]
+            for child in children:
+                if not visited[child]:
+                    visited[child] = True
+                    stack.append((child, iter(succs[child])))
+                    break
+            else:
+                stack.pop()
+                order.append(node)
+        postorder = [0] * count
+        for (number, node) in enumerate(order):
+            postorder[node] = number
+        preds = [[] for _ in range(count)]
+        for (node, children) in enumerate(succs):
+            for child in children:
+                preds[child].append(node)
+
+        def intersect(a, b):
+            while a != b:
+                while postorder[a] < postorder[b]:
+                    a = idom[a]
+                while postorder[b] < postorder[a]:
+                    b = idom[b]
+            return a
+
+        idom = [None] * count
+        idom[0] = 0
+        reverse_postorder = order[-2::-1]
+        changed = True
+        while changed:
+            changed = False
+            for node in reverse_postorder:
+                new_idom = None
+                for pred in preds[node]:
+                    if idom[pred] is not None:
+                        new_idom = pred if new_idom is None else intersect(pred, new_idom)
+                if idom[node] != new_idom:
+                    idom[node] = new_idom
+                    changed = True
+        return idom, order
+
+    @staticmethod
+    def retained_sizes(sizes, idom, order):
+        # Postorder visits every node before its immediate dominator, so subtree sums are complete when used
+        retained = list(sizes)
+        retained_count = [1] * len(sizes)
+        for node in order:
+            if node != 0:
+                retained[idom[node]] += retained[node]
+                retained_count[idom[node]] += retained_count[node]
+        return retained, retained_count
+
+    def invoke(self, arg, from_tty):
+        args = self.parser.parse_gdb_args(arg)
+        root = SVMUtil.resolve_address(args.expr)
+        if not root:
+            raise gdb.GdbError('svm-sizeof: "%s" is null' % args.expr)
+        layout = SVMLayout.of_object(root)
+        if layout is None:
+            raise gdb.GdbError('svm-sizeof: unknown type of object at 0x%x' % root)
+        length = layout.array_length(SVMUtil.read_memory(root, layout.header_size))
+        print('Shallow size of %s @ 0x%x: %d bytes' % (layout.typename, root, layout.object_size(length)))
+        if not args.retained:
+            return
+
+        skip = (lambda addr: False) if SVMHeap.in_image_heap(root) else SVMHeap.in_image_heap
+        try:
+            (addrs, layouts, sizes, succs, truncated, unreadable) = SVMCommandSizeof.walk(root, args.max_objects, skip)
+        except KeyboardInterrupt:
+            print('Interrupted.')
+            return
+        (idom, order) = SVMCommandSizeof.dominators(succs)
+        (retained, retained_count) = SVMCommandSizeof.retained_sizes(sizes, idom, order)
+        print('Retained size: %d bytes in %d objects (%d objects reachable)%s%s' % (
+            retained[0], retained_count[0], len(addrs), ' [incomplete: --max-objects reached]' if truncated else '',
+            ' [%d unreadable objects counted as 0 bytes]' % unreadable if unreadable else ''))
+        dominated = sorted((node for node in range(1, len(addrs)) if idom[node] == 0), key=lambda node: retained[node], reverse=True)
+        for node in dominated[:args.top]:
+            typename = layouts[node].typename if layouts[node] else '<unknown>'
+            print('  {:>12} bytes {:>8} objects  {} @ 0x{:x}'.format(retained[node], retained_count[node], typename, addrs[node]))
+SVMCommandSizeof()
+
+
+class SVMCommandBatch(gdb.Command):
+    '''Use this command to evaluate a script of Java debug-expressions per thread and frame and emit JSON lines
+Usage: svm-batch <script> [--out FILE]
+The script contains one expression (as accepted by pp) per line. Lines starting with # are comments.
+Directives: @threads all|current, @frames N (innermost N frames), @depth N (object nesting), @elements N (array elements)'''
+    def __init__(self):
+        super().__init__('svm-batch', gdb.COMMAND_DATA)
+        self.parser = SVMArgumentParser('svm-batch')
+        self.parser.add_argument('script')
+        self.parser.add_argument('--out')
+        self.plans = dict()
+
+    @staticmethod
+    def read_script(filename):
+        settings = {'threads': 'current', 'frames': 1, 'depth': 1, 'elements': 100}
+        exprs = []
+        with open(filename) as script:
+            for line in script:
+                line = line.strip()
+                if not line or line.startswith('#'):
+                    continue
+                if line.startswith('@'):
+                    (name, _, value) = line[1:].partition(' ')
+                    if name not in settings:
+                        raise gdb.GdbError('svm-batch: unknown directive @%s' % name)
+                    settings[name] = value.strip() if name == 'threads' else int(value)
+                    continue
+                exprs.append(line)
+        return settings, exprs
+
+    @staticmethod
+    def make_plan(expr):
+        '''Splits expr into the primary gdb expression and the field/index steps applied to it'''
+        parts = expr.split('.')
+        for count in range(1, len(parts) + 1):
+            (primary, indices) = SVMCommandPrettyPrint.splitindex(parts[count - 1])
+            primary = '.'.join(parts[:count - 1] + [primary])
+            try:
+                gdb.parse_and_eval("'" + primary + "'" if '.' in primary else primary)
+            except gdb.error:
+                continue
+            steps = [('index', index) for index in indices]
+            for part in parts[count:]:
+                (identifier, indices) = SVMCommandPrettyPrint.splitindex(part)
+                steps.append(('field', identifier))
+                steps.extend(('index', index) for index in indices)
+            return ("'" + primary + "'" if '.' in primary else primary), steps
+        return None
+
+    def evaluate(self, expr):
+        '''Returns (value, is_ref) following the cached accessor plan of expr with raw memory reads'''
+        plan = self.plans.get(expr)
+        if plan is None:
+            plan = SVMCommandBatch.make_plan(expr)
+            if plan is None:
+                raise gdb.GdbError('No Java debug-expression "%s" in current context.' % expr)
+            self.plans[expr] = plan
+        (primary, steps) = plan
+        value = gdb.parse_and_eval(primary)
+        if value.type.strip_typedefs().code != gdb.TYPE_CODE_PTR:
+            if steps:
+                raise gdb.GdbError('"%s" is not an object' % primary)
+            return SVMCommandBatch.primitive(value), False
+        # Static fields can hold compressed references too
+        (value, is_ref) = (int(SVMUtil.decode_value(value)), True)
+        for (kind, key) in steps:
+            if not is_ref or not value:
+                raise gdb.GdbError('cannot apply %s to %s' % (key, 'null' if is_ref else 'primitive value'))
+            layout = SVMLayout.of_object(value)
+            if layout is None:
+                raise gdb.GdbError('unknown hub for object at 0x%x' % value)
+            if kind == 'field':
+                (value, is_ref) = layout.read_field(value, key)
+            elif isinstance(key, str):
+                # Map key lookup goes through the high level representation
+                pp = makeHighLevelObject(SVMPPClass(gdb.Value(value).cast(layout.ptr_type)))
+                if not hasattr(pp, 'lookup'):
+                    raise gdb.GdbError('%s does not support key lookup' % layout.typename)
+                result = pp.lookup(key)
+                if result is None:
+                    raise gdb.GdbError('no key "%s"' % key)
+                (value, is_ref) = (int(SVMUtil.decode_value(result)), True) if result.type.code == gdb.TYPE_CODE_PTR else (SVMCommandBatch.primitive(result), False)
+            else:
+                (value, is_ref) = layout.read_element(value, key)
+        return value, is_ref
+
+    @staticmethod
+    def primitive(value):
+        code = value.type.strip_typedefs().code
+        if code == gdb.TYPE_CODE_FLT:
+            return float(value)
+        if code == gdb.TYPE_CODE_BOOL:
+            return bool(value)
+        return int(value)
+
+    @staticmethod
+    def json_object(addr, depth, max_elements):
+        if not addr:
+            return None
+        layout = SVMLayout.of_object(addr)
+        if layout is None:
+            return {'address': hex(addr), 'error': 'unknown hub'}
+        if layout.typename == 'java.lang.String':
+            return SVMUtil.read_javastr(addr)
+        header = SVMUtil.read_memory(addr, layout.header_size)
+        result = {'address': hex(addr), 'type': layout.typename}
+
+        def convert(value, is_ref):
+            if not is_ref:
+                return value
+            return SVMCommandBatch.json_object(value, depth - 1, max_elements) if depth > 0 else (hex(value) if value else None)
+
+        if layout.is_array():
+            length = layout.array_length(header)
+            result['length'] = length
+            elements = []
+            if layout.elem_format and max_elements > 0:
+                elements = next(layout.iter_elements(addr, min(length, max_elements)), [])
+            result['elements'] = [convert(value, layout.elem_is_ref) for value in elements]
+        else:
+            result['fields'] = dict((name, convert(value, is_ref)) for (name, value, is_ref) in layout.decode(header))
+        return result
+
+    def frames(self, settings):
+        threads = [gdb.selected_thread()]
+        if settings['threads'] == 'all':
+            threads = sorted(gdb.selected_inferior().threads(), key=lambda thread: thread.num)
+        for thread in threads:
+            thread.switch()
+            frame = gdb.newest_frame()
+            level = 0
+            while frame is not None and level < settings['frames']:
+                frame.select()
+                yield thread, level, frame
+                frame = frame.older()
+                level += 1
+
+    def invoke(self, arg, from_tty):
+        args = self.parser.parse_gdb_args(arg)
+        (settings, exprs) = SVMCommandBatch.read_script(args.script)
+        out = open(args.out, 'w') if args.out else sys.stdout
+        (thread, frame) = (gdb.selected_thread(), gdb.selected_frame())
+        try:
+            for (current_thread, level, current_frame) in self.frames(settings):
+                for expr in exprs:
+                    record = {'thread': current_thread.num, 'frame': level, 'function': current_frame.name(), 'expr': expr}
+                    try:
+                        (value, is_ref) = self.evaluate(expr)
+                        record['value'] = SVMCommandBatch.json_object(value, settings['depth'], settings['elements']) if is_ref else value
+                    except (gdb.error, gdb.GdbError, KeyError, IndexError) as e:
+                        record['error'] = str(e)
+                    out.write(json.dumps(record) + '\n')
+        except KeyboardInterrupt:
+            print('Interrupted.')
+        finally:
+            if args.out:
+                out.close()
+            thread.switch()
+            frame.select()
+SVMCommandBatch()
+
+
+class SVMCommandSample(gdb.Command):
+    '''Use this command to sample the Java stacks of all threads of the running inferior
+Usage: svm-sample [--interval MS] [--duration S] [--out FILE]
+The inferior is interrupted every MS milliseconds for S seconds and all threads are unwound.
+Stacks are written in folded format (one "frame;frame;... count" line per distinct stack, outermost frame first)
+as expected by flame graph tools.'''
+    def __init__(self):
+        super().__init__('svm-sample', gdb.COMMAND_STACK)
+        self.parser = SVMArgumentParser('svm-sample')
+        self.parser.add_argument('--interval', type=float, default=10)
+        self.parser.add_argument('--duration', type=float, default=10)
+        self.parser.add_argument('--out')
+
+    @staticmethod
+    def frames():
+        frame = gdb.newest_frame()
+        while frame is not None:
+            yield FrameDecorator(frame)
+            frame = frame.older()
+
+    @staticmethod
+    def nameless_pc(frame):
+        if isinstance(frame, SVMFrameDeopt) or frame.inferior_frame().name():
+            return None
+        return frame.inferior_frame().pc()
+
+    @staticmethod
+    def sample(stacks):
+        for thread in gdb.selected_inferior().threads():
+            thread.switch()
+            try:
+                frames = list(SVMFrameFilter.decorate(SVMCommandSample.frames()))
+                # SVMFrame shows nameless frames with their sp, which differs in every sample; key them by symbol or pc
+                pcs = [SVMCommandSample.nameless_pc(frame) for frame in frames]
+                symbols = SVMSymbolIndex.lookup_all(pc for pc in pcs if pc is not None)
+                # Same decoration as backtraces; frame function names are cached per pc across samples
+                stack = tuple((frame.function() if pc is None else symbols.get(pc, '0x%x' % pc)).replace(';', ':')
+                              for (frame, pc) in zip(frames, pcs))
+            except gdb.error as e:
+                trace('<svm-sample exception: %s>' % e)
+                continue
+            stacks[stack[::-1]] += 1
+
+    def invoke(self, arg, from_tty):
+        args = self.parser.parse_gdb_args(arg)
+        inferior = gdb.selected_inferior()
+        if not inferior.pid or gdb.selected_thread() is None:
+            raise gdb.GdbError('svm-sample: the program is not being run')
+        thread = gdb.selected_thread()
+        stacks = collections.Counter()
+        (samples, sampling_time) = (0, 0.0)
+        start = time.time()
+        try:
+            while time.time() - start < args.duration:
+                # Stop the inferior with SIGINT after the interval (not passed on to the program)
+                timer = threading.Timer(args.interval / 1000.0, os.kill, (inferior.pid, signal.SIGINT))
+                timer.start()
+                try:
+                    gdb.execute('continue', False, True)
+                finally:
+                    timer.cancel()
+                if not inferior.pid:
+                    print('The program exited.')
+                    break
+                sample_start = time.time()
+                SVMCommandSample.sample(stacks)
+                sampling_time += time.time() - sample_start
+                samples += 1
+        except KeyboardInterrupt:
+            print('Interrupted.')
+        finally:
+            if thread.is_valid():
+                thread.switch()
+
+        out = open(args.out, 'w') if args.out else sys.stdout
+        try:
+            for (stack, count) in stacks.most_common():
+                out.write('%s %d\n' % (';'.join(stack), count))
+        finally:
+            if args.out:
+                out.close()
+        elapsed = time.time() - start
+        print('%d samples of %d distinct stacks in %.1fs (%.1fms per sample spent unwinding)' % (
+            samples, len(stacks), elapsed, 1000.0 * sampling_time / samples if samples else 0))
+        if SVMPrintBudget.active():
+            print(SVMPrintBudget.report())
+SVMCommandSample()
+
+
+class SVMCommandThreads(gdb.Command):
+    '''Use this command to print the stacks of all threads with identical stacks grouped together
+Usage: svm-threads [--top N] [--json FILE]
+Each distinct stack is printed once, preceded by the number and ids of the threads sharing it, most common stacks first.
+With --json the shown stacks are also written to FILE as a JSON list of {"threads", "frames"} objects.'''
+    def __init__(self):
+        super().__init__('svm-threads', gdb.COMMAND_STACK)
+        self.parser = SVMArgumentParser('svm-threads')
+        self.parser.add_argument('--top', type=int, default=0)
+        self.parser.add_argument('--json')
+
+    @staticmethod
+    def collect():
+        '''Returns a list of [threads, rendered frames] for each distinct pc sequence'''
+        groups = collections.OrderedDict()
+        for thread in sorted(gdb.selected_inferior().threads(), key=lambda thread: thread.num):
+            thread.switch()
+            try:
+                frames = list(SVMCommandSample.frames())
+                key = tuple(frame.inferior_frame().pc() for frame in frames)
+                group = groups.get(key)
+                if group is None:
+                    # Frames are only valid while their thread is selected, so render now
+                    group = groups[key] = [[], [frame.function() for frame in SVMFrameFilter().filter(iter(frames))]]
+            except gdb.error as e:
+                trace('<svm-threads exception: %s>' % e)
+                group = groups.setdefault(('error', str(e)), [[], ['<%s>' % e]])
+            group[0].append(thread)
+        return list(groups.values())
+
+    def invoke(self, arg, from_tty):
+        args = self.parser.parse_gdb_args(arg)
+        if gdb.selected_thread() is None:
+            raise gdb.GdbError('svm-threads: no threads')
+        thread = gdb.selected_thread()
+        try:
+            groups = SVMCommandThreads.collect()
+        except KeyboardInterrupt:
+            print('Interrupted.')
+            return
+        finally:
+            if thread.is_valid():
+                thread.switch()
+        groups.sort(key=lambda group: len(group[0]), reverse=True)
+        thread_count = sum(len(threads) for (threads, _) in groups)
+        shown = groups[:args.top] if args.top > 0 else groups
+        if args.json:
+            with open(args.json, 'w') as out:
+                json.dump([{'threads': [{'num': thread.num, 'name': thread.name} for thread in threads], 'frames': functions}
+                           for (threads, functions) in shown], out)
+        with SVMCommandBreak.pagination_off():
+            for (threads, functions) in shown:
+                names = ', '.join('%d' % thread.num + (' "%s"' % thread.name if thread.name else '') for thread in threads)
+                gdb.write('%d thread%s: %s\n' % (len(threads), '' if len(threads) == 1 else 's', names))
+                for (level, function) in enumerate(functions):
+                    gdb.write('  #%-3d %s\n' % (level, function))
+                gdb.write('\n')
+        print('%d distinct stacks in %d threads%s' % (
+            len(groups), thread_count, '' if len(shown) == len(groups) else ' (%d shown)' % len(shown)))
+SVMCommandThreads()
+
+
+class SVMCommandPrintBudget(gdb.Command):
+    '''Use this command to limit the time and memory reads spent pretty printing per stop and per value
+Usage: svm-print-budget [--stop-ms N] [--stop-bytes N] [--value-ms N] [--value-bytes N] | off
+Once a limit is reached values are printed as type, address and length (or a prefix) and marked [truncated].
+The per-stop budget is renewed at every stop and prompt. Without arguments the limits and counts are shown.'''
+    def __init__(self):
+        super().__init__('svm-print-budget', gdb.COMMAND_USER)
+        self.parser = SVMArgumentParser('svm-print-budget')
+        for name in ['stop-ms', 'stop-bytes', 'value-ms', 'value-bytes']:
+            self.parser.add_argument('--' + name, type=int)
+
+    def invoke(self, arg, from_tty):
+        if arg.strip() in ['off', 'disable']:
+            (SVMPrintBudget.stop_ms, SVMPrintBudget.stop_bytes, SVMPrintBudget.value_ms, SVMPrintBudget.value_bytes) = (0, 0, 0, 0)
+        elif arg.strip():
+            args = self.parser.parse_gdb_args(arg)
+            for name in ['stop_ms', 'stop_bytes', 'value_ms', 'value_bytes']:
+                if getattr(args, name) is not None:
+                    setattr(SVMPrintBudget, name, max(0, getattr(args, name)))
+            SVMPrintBudget.totals.clear()
+            SVMPrintBudget.reset()
+        if not SVMPrintBudget.active():
+            print('svm-print-budget is disabled')
+            return
+        limit = lambda value, unit: '%d%s' % (value, unit) if value else 'unlimited'
+        print('per stop: %s, %s; per value: %s, %s' % (
+            limit(SVMPrintBudget.stop_ms, 'ms'), limit(SVMPrintBudget.stop_bytes, ' bytes'),
+            limit(SVMPrintBudget.value_ms, 'ms'), limit(SVMPrintBudget.value_bytes, ' bytes')))
+        print(SVMPrintBudget.report())
+SVMCommandPrintBudget()
+
+
 class ThreadStackPrinterPrintBacktraceBP(gdb.Breakpoint):
     BreakpointSpec = 'com.oracle.svm.core.stack.ThreadStackPrinter.printBacktrace'
     @staticmethod
@@ -1073,11 +3716,8 @@ class ThreadStackPrinterPrintBacktraceBP(gdb.Breakpoint):
         with SVMCommandBreak.pagination_off():
             gdb.execute('backtrace')
             print()
-            lineStart = 'File '
-            lineStartLen = len(lineStart)
-            for line in gdb.execute('info functions', False, True).split('\n'):
-                if line.startswith(lineStart) and 'at 0x' in line:
-                    print('== InstalledCode: ' + line[lineStartLen:-1])
+            for installed in SVMListing.functions.iter_entries('installed'):
+                print('== InstalledCode: ' + installed)
             print()
         return False
 
@@ -1097,26 +3737,37 @@ class SVMFrameUnwinder(Unwinder):
         super().__init__('SubstrateVM FrameUnwinder')
         self.stack_type = gdb.lookup_type('long')
         self.deopt_frame_type = gdb.lookup_type('com.oracle.svm.core.deopt.DeoptimizedFrame')
+        # (sp, pc) -> (caller sp, caller pc) of deoptimized frames, valid until the inferior resumes
+        self.unwind_cache = dict()
+
+    def clear_cache(self, event=None):
+        self.unwind_cache.clear()
 
     def __call__(self, pending_frame):
         try:
-            rsp = pending_frame.read_register(self.AMD64_RSP)
+            # Most frames are not deopt stubs: reject them after a single register read
             rip = pending_frame.read_register(self.AMD64_RIP)
-            if int(rip) == SVMUtil.deopt_stub_addr:
+            if int(rip) not in SVMUtil.deopt_stub_addrs:
+                return None
+            rsp = pending_frame.read_register(self.AMD64_RSP)
+            key = (int(rsp), int(rip))
+            caller = self.unwind_cache.get(key)
+            if caller is None:
                 deopt_frame_stack_slot = rsp.cast(self.stack_type.pointer()).dereference()
                 deopt_frame = deopt_frame_stack_slot.cast(self.deopt_frame_type.pointer())
                 source_frame_size = deopt_frame['sourceTotalFrameSize']
                 # Now find the register-values for the caller frame
-                unwind_info = pending_frame.create_unwind_info(SVMFrameUnwinder.FrameId(rsp, rip))
-                caller_rsp = rsp + int(source_frame_size)
-                unwind_info.add_saved_register(self.AMD64_RSP, gdb.Value(caller_rsp))
-                caller_rip = gdb.Value(caller_rsp - 8).cast(self.stack_type.pointer()).dereference()
-                unwind_info.add_saved_register(self.AMD64_RIP, gdb.Value(caller_rip))
-                return unwind_info
-        except:
-            pass # Fallback to default frame unwinding via debug_frame (dwarf)
+                caller_rsp = int(rsp) + int(source_frame_size)
+                caller_rip = int(gdb.Value(caller_rsp - 8).cast(self.stack_type.pointer()).dereference())
+                caller = self.unwind_cache[key] = (caller_rsp, caller_rip)
+            unwind_info = pending_frame.create_unwind_info(SVMFrameUnwinder.FrameId(rsp, rip))
+            unwind_info.add_saved_register(self.AMD64_RSP, gdb.Value(caller[0]).cast(rsp.type))
+            unwind_info.add_saved_register(self.AMD64_RIP, gdb.Value(caller[1]).cast(rip.type))
+            return unwind_info
+        except gdb.error as e:
+            trace('<SVMFrameUnwinder exception: %s>' % e)
 
-        return None
+        return None # Fallback to default frame unwinding via debug_frame (dwarf)
 
 
 class SVMFrameFilter():
@@ -1126,27 +3777,90 @@ class SVMFrameFilter():
         self.enabled = True
 
     def filter(self, frame_iter):
+        frames = SVMFrameFilter.decorate(frame_iter)
+        if SVMUtil.bt_compact:
+            frames = SVMFrameFilter.compact(frames)
+        return frames
+
+    @staticmethod
+    def decorate(frame_iter):
         for frame in frame_iter:
             frame = frame.inferior_frame()
-            if SVMUtil.deopt_stub_addr and frame.pc() == SVMUtil.deopt_stub_addr:
+            if frame.pc() in SVMUtil.deopt_stub_addrs:
                 yield SVMFrameDeopt(frame)
             else:
                 yield SVMFrame(frame)
 
+    @staticmethod
+    def compact(frames):
+        # Collapse runs of consecutive frames with the same function and location (i.e. recursion)
+        run = []
+        for frame in frames:
+            if run and frame.function() == run[0].function():
+                run.append(frame)
+                continue
+            if len(run) > 1:
+                yield SVMFrameRepeated(run[0].inferior_frame(), len(run))
+            elif run:
+                yield run[0]
+            run = [frame]
+        if len(run) > 1:
+            yield SVMFrameRepeated(run[0].inferior_frame(), len(run))
+        elif run:
+            yield run[0]
+
+
 class SVMFrame(FrameDecorator):
+    function_cache = collections.OrderedDict()
+    function_cache_size = 4096
+
+    @classmethod
+    def clear_cache(cls, event=None):
+        cls.function_cache.clear()
+
     def function(self):
         frame = self.inferior_frame()
+        # The innermost frame uses its pc for the line lookup, callers use pc - 1
+        key = (frame.pc(), frame.newer() is None, frame.name() if frame.type() == gdb.INLINE_FRAME else None)
+        cache = SVMFrame.function_cache
+        function = cache.get(key)
+        if function is not None:
+            cache.move_to_end(key)
+            return function
         if not frame.name():
             return 'Unknown Frame at ' + hex(int(frame.read_register('sp')))
         func_name = str(frame.name().split('(')[0])
         if frame.type() == gdb.INLINE_FRAME:
             func_name = '<-- ' + func_name
         eclipse_filename = '(' + os.path.basename(self.filename()) + ':' + str(self.line()) + ')'
-        return func_name + eclipse_filename
+        function = func_name + eclipse_filename
+        cache[key] = function
+        if len(cache) > SVMFrame.function_cache_size:
+            cache.popitem(last=False)
+        return function
+
+
+class SVMFrameRepeated(SVMFrame):
+    def __init__(self, frame, count):
+        super().__init__(frame)
+        self.count = count
+
+    def function(self):
+        return super().function() + ' [%d recursive frames]' % self.count
 
 
 class SVMFrameDeopt(SVMFrame):
     def function(self):
+        # The deoptimized method is where the frame returned to before its return address was patched to the stub
+        try:
+            frame = self.inferior_frame()
+            deopt_frame_type = gdb.lookup_type('com.oracle.svm.core.deopt.DeoptimizedFrame').pointer()
+            deopt_frame = frame.read_register('sp').cast(gdb.lookup_type('long').pointer()).dereference().cast(deopt_frame_type)
+            source = SVMSymbolIndex.lookup(int(deopt_frame['sourcePC']))
+            if source is not None:
+                return '[DEOPT FRAMES of %s ...]' % source.split('(')[0]
+        except gdb.error as e:
+            trace('<SVMFrameDeopt exception: %s>' % e)
         return '[DEOPT FRAMES ...]'
 
     def frame_args(self):
@@ -1166,17 +3880,33 @@ try:
 
     gdb.printing.register_pretty_printer(gdb.current_objfile(), SVMPrettyPrinter())
     gdb.prompt_hook = SVMUtil.selfref_reset
-
-    SVMUtil.deopt_stub_addr = SVMUtil.get_symbol_address('com.oracle.svm.core.deopt.Deoptimizer.deoptStub')
-
-    if SVMUtil.deopt_stub_addr:
-        SVMUtil.frame_unwinder = SVMFrameUnwinder()
-        gdb.unwinder.register_unwinder(gdb.current_objfile(), SVMUtil.frame_unwinder)
+    gdb.events.stop.connect(SVMUtil.selfref_reset)
+    gdb.events.stop.connect(SVMPrintBudget.reset)
+    if hasattr(gdb.events, 'before_prompt'):
+        gdb.events.before_prompt.connect(SVMPrintBudget.reset)
+    gdb.events.new_objfile.connect(SVMLayout.reset)
+    gdb.events.new_objfile.connect(SVMUtil.reset_ref_encodings)
+    gdb.events.exited.connect(SVMUtil.reset_ref_encodings)
+    gdb.events.new_objfile.connect(SVMHeap.reset)
+    gdb.events.cont.connect(SVMHeap.reset_chunks)
+    gdb.events.new_objfile.connect(SVMFrame.clear_cache)
+    gdb.events.new_objfile.connect(SVMSymbolIndex.objfile_added)
+    gdb.events.new_objfile.connect(SVMCoreFile.reset)
+    SVMListing.refresh_all()
+    gdb.events.new_objfile.connect(SVMListing.refresh_all)
+    gdb.events.exited.connect(SVMCoreFile.reset)
+    if hasattr(gdb.events, 'clear_objfiles'):
+        gdb.events.clear_objfiles.connect(SVMSymbolIndex.reset)
+        gdb.events.clear_objfiles.connect(SVMListing.restart_all)
+
+    SVMUtil.update_deopt_stubs()
+    gdb.events.new_objfile.connect(SVMUtil.update_deopt_stubs)
 
     ThreadStackPrinterPrintBacktraceBP.installOnce()
 
     SVMUtil.frame_filter = SVMFrameFilter()
-    if sys.platform.startswith('darwin'):
+    # There is no current objfile when this file is loaded with `source` instead of auto-loading
+    if sys.platform.startswith('darwin') or gdb.current_objfile() is None:
         gdb.frame_filters[SVMUtil.frame_filter.name] = SVMUtil.frame_filter
     else:
         gdb.current_objfile().frame_filters[SVMUtil.frame_filter.name] = SVMUtil.frame_filter